@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+
+# ===== マスク着用率の集計（Streamlit 非依存） =====
+COUNT_COLUMNS = ['total_no_mask', 'total_active']
+
+# ===== 省メモリのフレーム =====
+# 地区・店舗名・種別は行ごとに同じ文字列を持たずカテゴリ（整数コード）にし、
+# 人数と年・月は値に合う幅の整数、着用率は float32、日付は datetime にする
+DIMENSION_COLUMNS = ['area', 'store_name', 'type']
+_COUNT_SUFFIXES = ('_no_mask', '_active', '_sum', 'row_count', 'year', 'month')
+
+def _downcast_count(values):
+    # 未登録（NaN）を含む列は float32、それ以外は最小の整数型（集計時は int64 で合計される）
+    if values.isna().any():
+        return values.astype('float32')
+    return pd.to_numeric(values, downcast='integer')
+
+def compact(df):
+    columns = {}
+    for column in df.columns:
+        values = df[column]
+        if column in DIMENSION_COLUMNS:
+            values = values.astype('category')
+        elif column == 'date':
+            values = pd.to_datetime(values)
+        elif column.endswith(_COUNT_SUFFIXES):
+            values = _downcast_count(values)
+        elif column.endswith('_mask_rate'):
+            values = values.astype('float32')
+        columns[column] = values
+    return pd.DataFrame(columns, index=df.index)
+
+def memory_bytes(df):
+    # 文字列の中身まで含めた使用量
+    return int(df.memory_usage(deep=True).sum())
+
+def memory_report(frames):
+    # frames: {名前: (変換前, 変換後)}。変換前後の行数とメモリ使用量を返す
+    rows = []
+    for name, (before, after) in frames.items():
+        before_bytes = memory_bytes(before)
+        after_bytes = memory_bytes(after)
+        rows.append({
+            'name': name,
+            'rows': len(after),
+            'before_bytes': before_bytes,
+            'after_bytes': after_bytes,
+            'ratio': after_bytes / before_bytes if before_bytes else None,
+        })
+    return pd.DataFrame(rows)
+
+def mask_rate(no_mask, active):
+    # 着用率（％）。稼働人数が0または未登録の場合は NaN
+    no_mask = np.asarray(no_mask, dtype='float64')
+    active = np.asarray(active, dtype='float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = (active - no_mask) / active * 100
+    return np.where(active > 0, rate, np.nan)
+
+def format_rate(rate):
+    # 着用率（0〜1）の表示。一覧の表とダウンロードで共通（未登録は空欄）
+    return f"{rate*100:.1f}%" if pd.notnull(rate) else ""
+
+def store_totals(df):
+    # 生データを (地区, 店舗, 日付) ごとに1回だけ集計する
+    return (
+        df.groupby(['area', 'store_name', 'date'], observed=True, sort=True)[COUNT_COLUMNS]
+        .sum()
+        .reset_index()
+    )
+
+def rate_series(totals, keys):
+    # totals を keys + 日付 で合算し、着用率の系列（long 形式）を返す
+    grouped = totals.groupby(keys + ['date'], observed=True, sort=True)[COUNT_COLUMNS].sum().reset_index()
+    grouped = grouped[grouped['total_active'] > 0]
+    grouped['mask_rate'] = mask_rate(grouped['total_no_mask'], grouped['total_active'])
+    return grouped[keys + ['date', 'mask_rate']].reset_index(drop=True)
+
+def compute_all(df):
+    # 全地区・地区別・店舗別の系列をまとめて算出する
+    totals = store_totals(df)
+    return {
+        'overall': rate_series(totals, []),
+        'area': rate_series(totals, ['area']),
+        'store': rate_series(totals, ['area', 'store_name']),
+    }
+
+def add_date_label(series):
+    # 日付ラベルは日付の種類ごとに1回だけ整形し、行にはカテゴリのコードだけを持たせる
+    # （「YYYY年MM月」は文字列順が日付順なので、カテゴリの順序もそのまま日付順になる）
+    codes, uniques = pd.factorize(pd.to_datetime(series['date']))
+    labels = pd.Categorical(pd.DatetimeIndex(uniques).strftime('%Y年%m月'))
+    series = series.copy()
+    series['date_label'] = labels.take(codes)
+    return series
@@ -1,100 +1,58 @@
 import streamlit as st
-import sqlite3
 import pandas as pd
-from matplotlib import rcParams
-import matplotlib.pyplot as plt
-from matplotlib.font_manager import FontProperties
 from datetime import datetime
-import os
-import plotly.express as px  # Plotly追加
+import importlib
 import config
-import store
-import mask
-import active
-import edit
 import comment
-
-# --- フォントパスの設定 ---
-font_path = os.path.join(os.path.dirname(__file__), "fonts", "ipaexg.ttf")
-if os.path.exists(font_path):
-    font_prop = FontProperties(fname=font_path)
-    rcParams['font.family'] = font_prop.get_name()
-else:
-    print("フォントが見つかりません:", font_path)
-
-# ===== DB接続 =====
-DB_FILE = 'mask.db'
-
-def get_connection():
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def get_mask_status_all():
-    conn = get_connection()
-    df = pd.read_sql_query('''
-        SELECT ms.id, s.store_name, ms.date, ms.year, ms.month,
-               ms.pachinko_no_mask, ms.slot_no_mask, ms.total_no_mask,
-               ms.pachinko_active, ms.slot_active, ms.total_active,
-               ms.pachinko_mask_rate, ms.slot_mask_rate, ms.total_mask_rate,
-               s.area, s.type
-        FROM mask_status ms
-        JOIN store s ON ms.store_id = s.id
-        ORDER BY ms.date DESC, ms.store_id
-    ''', conn)
-    conn.close()
-    return df
+import db
+import analytics
+import charts
+import export
+import planner
+import profiling
+import snapshot
+
+# ===== データ取得 =====
+def _load_rollup():
+    df = analytics.compact(db.get_rollup())
+    return df.rename(columns={'total_no_mask_sum': 'total_no_mask', 'total_active_sum': 'total_active'})
+
+def get_rollup():
+    # 地区・種別・日付ごとの集計済みデータ（数十行程度）
+    return db.cached('app.rollup', _load_rollup)
+
+def _to_rate_series(df):
+    # 店舗・日付ごとの人数合計 → 着用率の系列（地区・店舗名はカテゴリ、日付ラベルは日付の種類ごと）
+    return analytics.add_date_label(analytics.rate_series(analytics.compact(df), ['area', 'store_name']))
 
 def mask_rate_page():
     st.title("マスク着用率グラフ")
 
-    df_all = get_mask_status_all()
-    df_all['date'] = pd.to_datetime(df_all['date'])
-    df_all['date_label'] = df_all['date'].dt.strftime('%Y年%m月')
-
     graph_mode = st.radio("グラフ表示方法を選択", ["全地区", "地区別（平均比較）", "地区別（店舗比較）", "店舗別"])
     y_min, y_max = config.get_graph_y_range()
+    data_version = db.get_data_version()
 
     if graph_mode == "全地区":
-        grouped_all = df_all.groupby('date').agg(
-            total_no_mask_sum=('total_no_mask', 'sum'),
-            total_active_sum=('total_active', 'sum')
-        ).reset_index()
-        grouped_all['mask_rate'] = (grouped_all['total_active_sum'] - grouped_all['total_no_mask_sum']) / grouped_all['total_active_sum'] * 100
-        grouped_all = grouped_all[grouped_all['total_active_sum'] > 0]
-        grouped_all['地区'] = '全地区'
-        grouped_all['date_label'] = grouped_all['date'].dt.strftime('%Y年%m月')
-
-        fig = px.line(
-            grouped_all,
+        charts.plot_line(
+            (graph_mode, None, data_version),
+            lambda: analytics.add_date_label(analytics.rate_series(get_rollup(), [])),
+            (y_min, y_max),
             x="date_label",
             y="mask_rate",
             markers=True,
             labels={"date_label": "日付", "mask_rate": "着用率（％）"},
             title="全地区のマスク着用率推移"
         )
-        fig.update_layout(yaxis_range=[y_min, y_max])
-        st.plotly_chart(fig, use_container_width=True)
 
     elif graph_mode == "地区別（平均比較）":
-        areas = [a for a in df_all['area'].dropna().unique() if a != '全地区']
-        plot_data = []
-        for area in areas:
-            df_area = df_all[df_all['area'] == area].copy()
-            grouped = df_area.groupby('date').agg(
-                total_no_mask_sum=('total_no_mask', 'sum'),
-                total_active_sum=('total_active', 'sum')
-            ).reset_index()
-            grouped['mask_rate'] = (grouped['total_active_sum'] - grouped['total_no_mask_sum']) / grouped['total_active_sum'] * 100
-            grouped = grouped[grouped['total_active_sum'] > 0]
-            grouped['地区'] = area
-            grouped['date_label'] = grouped['date'].dt.strftime('%Y年%m月')
-            plot_data.append(grouped[['date_label', 'mask_rate', '地区']])
-
-        df_plot = pd.concat(plot_data)
-
-        fig = px.line(
-            df_plot,
+        def build_area_average():
+            df_plot = analytics.add_date_label(analytics.rate_series(get_rollup(), ['area']))
+            return df_plot[df_plot['area'] != '全地区'].rename(columns={'area': '地区'})
+
+        charts.plot_line(
+            (graph_mode, None, data_version),
+            build_area_average,
+            (y_min, y_max),
             x="date_label",
             y="mask_rate",
             color="地区",
@@ -102,19 +60,14 @@ def mask_rate_page():
             labels={"date_label": "日付", "mask_rate": "着用率（％）", "地区": "地区"},
             title="地区別 平均マスク着用率推移"
         )
-        fig.update_layout(yaxis_range=[y_min, y_max])
-        st.plotly_chart(fig, use_container_width=True)
 
     elif graph_mode == "地区別（店舗比較）":
-        area_options = df_all['area'].dropna().unique()
-        selected_area = st.selectbox("地区を選択してグラフ表示", area_options)
+        selected_area = st.selectbox("地区を選択してグラフ表示", db.get_areas())
         if selected_area:
-            df_area = df_all[df_all['area'] == selected_area].copy()
-            df_area = df_area.sort_values('date')
-            df_area['mask_rate'] = df_area['total_mask_rate'] * 100
-
-            fig = px.line(
-                df_area,
+            charts.plot_line(
+                (graph_mode, selected_area, data_version),
+                lambda: planner.cached(planner.area_store_series(selected_area), _to_rate_series),
+                (y_min, y_max),
                 x="date_label",
                 y="mask_rate",
                 color="store_name",
@@ -122,27 +75,23 @@ def mask_rate_page():
                 labels={"date_label": "日付", "mask_rate": "着用率（％）", "store_name": "店舗"},
                 title=f"{selected_area} 地区 店舗別マスク着用率推移"
             )
-            fig.update_layout(yaxis_range=[y_min, y_max])
-            st.plotly_chart(fig, use_container_width=True)
 
     elif graph_mode == "店舗別":
-        store_options = df_all['store_name'].unique()
-        selected_store = st.selectbox("店舗を選択してグラフ表示", store_options)
-        if selected_store:
-            df_store = df_all[df_all['store_name'] == selected_store].copy()
-            df_store = df_store.sort_values('date')
-            df_store['mask_rate'] = df_store['total_mask_rate'] * 100
-
-            fig = px.line(
-                df_store,
+        stores = db.get_store_names()
+        store_names = dict(zip(stores['id'], stores['store_name']))
+        selected_store_id = st.selectbox("店舗を選択してグラフ表示", list(store_names), format_func=store_names.get)
+        if selected_store_id is not None:
+            selected_store = store_names[selected_store_id]
+            charts.plot_line(
+                (graph_mode, selected_store_id, data_version),
+                lambda: planner.cached(planner.store_series(selected_store_id), _to_rate_series),
+                (y_min, y_max),
                 x="date_label",
                 y="mask_rate",
                 markers=True,
                 labels={"date_label": "日付", "mask_rate": "着用率（％）"},
                 title=f"{selected_store} のマスク着用率推移"
             )
-            fig.update_layout(yaxis_range=[y_min, y_max])
-            st.plotly_chart(fig, use_container_width=True)
 
     # ===== 年月指定 表 ======
     st.markdown("---")
@@ -159,17 +108,19 @@ def mask_rate_page():
         default_month_index = months.index(current_month) if current_month in months else 0
         selected_month = st.selectbox("表示する月", months, index=default_month_index)
 
-    df_table = df_all[(df_all['year'] == selected_year) & (df_all['month'] == selected_month)].copy()
+    # 列指向スナップショット（MASK_SNAPSHOT=1）が最新ならそこから絞り込み、古い・未作成なら SQLite から読む
+    df_table = snapshot.year_month_table(selected_year, selected_month) if snapshot.ENABLED else None
+    if df_table is None:
+        df_table = planner.cached(planner.year_month_table(selected_year, selected_month))
 
-    if df_table.empty:
+    archived = db.get_archived_through()
+    month_archived = bool(archived) and (selected_year, (selected_month - 1) // 3 + 1) <= archived
+    if df_table.empty and month_archived:
+        st.info("この年月の明細はアーカイブ済みです（グラフと着用率の変化には四半期ごとの集計を表示しています）。")
+    elif df_table.empty:
         st.info("該当するデータがありません。")
     else:
-        df_table_display = df_table[[
-            'store_name',
-            'pachinko_no_mask', 'slot_no_mask', 'total_no_mask',
-            'pachinko_active', 'slot_active', 'total_active',
-            'pachinko_mask_rate', 'slot_mask_rate', 'total_mask_rate'
-        ]].copy()
+        df_table_display = df_table[planner.YEAR_MONTH_TABLE_COLUMNS].copy()
 
         df_table_display.columns = [
             '店舗名', '未着用P', '未着用S', '未着用計',
@@ -178,7 +129,7 @@ def mask_rate_page():
         ]
 
         for col in ['着用率P', '着用率S', '着用率計']:
-            df_table_display[col] = df_table_display[col].apply(lambda x: f"{x*100:.1f}%" if pd.notnull(x) else "")
+            df_table_display[col] = df_table_display[col].apply(analytics.format_rate)
 
         st.dataframe(
             df_table_display,
@@ -187,24 +138,78 @@ def mask_rate_page():
             hide_index=True
         )
 
+    if not df_table.empty or month_archived:
+        # 表示中の年月の明細（アーカイブ済みの明細を含む）をダウンロードする
+        export.render_download("dashboard_export", f"mask_{selected_year}{selected_month:02d}",
+                               year=selected_year, month=selected_month)
+
+    # ===== 着用率の変化（前回調査比・前年同期比） =====
+    st.markdown("---")
+    selected_quarter = (selected_month - 1) // 3 + 1
+    st.subheader(f"着用率の変化（{selected_year}年 第{selected_quarter}四半期）")
+    change_level = st.radio("集計単位", ["店舗別", "地区別"], horizontal=True, key="change_level")
+    level = 'store' if change_level == "店舗別" else 'area'
+
+    df_change = db.cached(
+        f"app.rate_changes.{level}.{selected_year}.{selected_quarter}",
+        lambda: db.get_rate_changes(level, selected_year, selected_quarter)
+    )
+
+    if df_change.empty:
+        st.info("該当するデータがありません。")
+    else:
+        df_change_display = df_change.copy()
+        df_change_display['前回調査'] = [
+            f"{int(y)}年 第{int(q)}四半期" if pd.notnull(y) else ""
+            for y, q in zip(df_change_display['prev_year'], df_change_display['prev_quarter'])
+        ]
+        for col in ['rate', 'change_prev', 'change_last_year']:
+            df_change_display[col] = df_change_display[col] * 100
+        # 変化の大きい順（前回調査比の絶対値）に並べる。表の見出しをクリックすると並べ替えできる
+        df_change_display = df_change_display.sort_values(
+            'change_prev', key=lambda s: s.abs(), ascending=False, na_position='last'
+        )
+        df_change_display = df_change_display.rename(columns={
+            'store_name': '店舗名', 'area': '地区', 'rate': '着用率（％）',
+            'change_prev': '前回調査比（pt）', 'change_last_year': '前年同期比（pt）'
+        })
+        columns = (['店舗名'] if level == 'store' else []) + ['地区', '着用率（％）', '前回調査', '前回調査比（pt）', '前年同期比（pt）']
+        st.dataframe(
+            df_change_display[columns],
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                '着用率（％）': st.column_config.NumberColumn(format="%.1f"),
+                '前回調査比（pt）': st.column_config.NumberColumn(format="%+.1f"),
+                '前年同期比（pt）': st.column_config.NumberColumn(format="%+.1f"),
+            }
+        )
+
     # ===== コメント表示 =====
     st.markdown("---")
-    comment.show_comments()
+    comment.show_comments(selected_year, selected_month)
+
+# ===== ページ切り替え（選択されたページのモジュールだけを読み込む） =====
+PAGES = {
+    "マスク着用率一覧": None,
+    "非着用者入力": ("mask", "mask_page"),
+    "店舗登録": ("store", "store_page"),
+    "稼働データ登録": ("active", "active_page"),
+    "データ修正": ("edit", "edit_page"),
+    "コメント管理": ("comment", "comment_page"),
+}
+
+def load_page(name):
+    if PAGES[name] is None:
+        return mask_rate_page
+    module_name, func_name = PAGES[name]
+    return getattr(importlib.import_module(module_name), func_name)
 
-# ===== ページ切り替え =====
 st.set_page_config(page_title="マスク管理システム", layout="wide")
+if snapshot.ENABLED:
+    snapshot.start()
 
-page = st.sidebar.selectbox("ページを選択", ("マスク着用率一覧", "非着用者入力", "店舗登録", "稼働データ登録", "データ修正", "コメント管理"))
-
-if page == "マスク着用率一覧":
-    mask_rate_page()
-elif page == "非着用者入力":
-    mask.mask_page()
-elif page == "店舗登録":
-    store.store_page()
-elif page == "稼働データ登録":
-    active.active_page()
-elif page == "データ修正":
-    edit.edit_page()
-elif page == "コメント管理":
-    comment.comment_page()
+page = st.sidebar.selectbox("ページを選択", tuple(PAGES))
+with profiling.rerun(page) as stats:
+    load_page(page)()
+profiling.render_panel(stats)
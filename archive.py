@@ -0,0 +1,122 @@
+import argparse
+import os
+import sqlite3
+from datetime import date
+import migrate
+import profiling
+import rollup
+import shards
+
+# ===== 古い四半期のアーカイブ（ブラウザ不要） =====
+# 直近 KEEP_QUARTERS 四半期より前の mask_status を別ファイル（<DB名>_archive.db）へ移し、
+# 本体には店舗ごとの四半期集計（mask_quarterly）だけを残す。
+# グラフ・着用率の変化・四半期レポートは四半期集計と本体の明細を合わせて表示する。
+# 例: python archive.py --keep-quarters 8
+KEEP_QUARTERS = 8
+ATTACH_NAME = 'archive'
+BUSY_TIMEOUT_MS = 5000
+
+def archive_file(db_file):
+    return os.path.splitext(db_file)[0] + '_archive.db'
+
+def cutoff_quarter(keep_quarters, today=None):
+    # 本体に残す最初の四半期 (年, 四半期)。今期を含めて keep_quarters 四半期を残す
+    today = today or date.today()
+    index = today.year * 4 + (today.month - 1) // 3 - (keep_quarters - 1)
+    return index // 4, index % 4 + 1
+
+def _ensure_archive_table(conn):
+    exists = conn.execute(
+        f"SELECT 1 FROM {ATTACH_NAME}.sqlite_master WHERE type = 'table' AND name = 'mask_status'"
+    ).fetchone()
+    if not exists:
+        conn.execute(migrate.MASK_STATUS_TABLE_SQL.format(name=f'{ATTACH_NAME}.mask_status', foreign_key=''))
+        conn.execute(f'CREATE INDEX {ATTACH_NAME}.idx_archive_store_date ON mask_status (store_id, date)')
+
+# 四半期の通し番号（年 × 4 + 四半期 - 1）が cutoff より小さい行
+_OLD_ROWS = 'year * 4 + (month - 1) / 3 < ?'
+
+def archive(db_file, keep_quarters=KEEP_QUARTERS, today=None, dry_run=False):
+    # 戻り値: (移した四半期のリスト, 移した行数)
+    if shards.ENABLED:
+        raise RuntimeError("地区別シャード構成（MASK_SHARDED=1）ではアーカイブできません。")
+    if keep_quarters < 1:
+        raise ValueError("残す四半期の数は1以上を指定してください。")
+    migrate.upgrade(db_file)
+    year, quarter = cutoff_quarter(keep_quarters, today)
+    cutoff = year * 4 + quarter - 1
+
+    conn = sqlite3.connect(db_file, isolation_level=None, timeout=BUSY_TIMEOUT_MS / 1000, factory=profiling.connection_factory())
+    try:
+        conn.execute(f'ATTACH DATABASE ? AS {ATTACH_NAME}', (archive_file(db_file),))
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            quarters = conn.execute(f'''
+                SELECT DISTINCT year, (month - 1) / 3 + 1 FROM main.mask_status
+                WHERE {_OLD_ROWS} ORDER BY 1, 2
+            ''', (cutoff,)).fetchall()
+            if dry_run or not quarters:
+                conn.execute('ROLLBACK')
+                return quarters, conn.execute(
+                    f'SELECT COUNT(*) FROM main.mask_status WHERE {_OLD_ROWS}', (cutoff,)
+                ).fetchone()[0]
+
+            _ensure_archive_table(conn)
+            dates = [row[0] for row in conn.execute(
+                f'SELECT DISTINCT date FROM main.mask_status WHERE {_OLD_ROWS}', (cutoff,)
+            )]
+            conn.execute(f'''
+                INSERT OR IGNORE INTO {ATTACH_NAME}.mask_status (
+                    id, store_id, date, year, month,
+                    pachinko_no_mask, slot_no_mask, pachinko_active, slot_active, row_version
+                )
+                SELECT id, store_id, date, year, month,
+                       pachinko_no_mask, slot_no_mask, pachinko_active, slot_active, row_version
+                FROM main.mask_status
+                WHERE {_OLD_ROWS}
+            ''', (cutoff,))
+            # 同じ四半期を後から追加してアーカイブし直した場合は集計に加算する
+            conn.execute(f'''
+                INSERT INTO mask_quarterly (
+                    store_id, year, quarter, date, total_no_mask, total_active, measured_no_mask, row_count
+                )
+                SELECT store_id, year, (month - 1) / 3 + 1, MAX(date),
+                       SUM(total_no_mask),
+                       COALESCE(SUM(total_active), 0),
+                       COALESCE(SUM(CASE WHEN total_active IS NOT NULL THEN total_no_mask END), 0),
+                       COUNT(*)
+                FROM main.mask_status
+                WHERE {_OLD_ROWS}
+                GROUP BY store_id, year, (month - 1) / 3 + 1
+                ON CONFLICT (store_id, year, quarter) DO UPDATE SET
+                    date = MAX(date, excluded.date),
+                    total_no_mask = total_no_mask + excluded.total_no_mask,
+                    total_active = total_active + excluded.total_active,
+                    measured_no_mask = measured_no_mask + excluded.measured_no_mask,
+                    row_count = row_count + excluded.row_count
+            ''', (cutoff,))
+            count = conn.execute(f'DELETE FROM main.mask_status WHERE {_OLD_ROWS}', (cutoff,)).rowcount
+            rollup.refresh_dates(conn, dates)
+            conn.execute('UPDATE main.data_version SET version = version + 1 WHERE id = 1')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    finally:
+        conn.close()
+    return quarters, count
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="古い四半期の mask_status をアーカイブ用のDBへ移します。")
+    parser.add_argument('--db', default=migrate.DB_FILE, help="本体のデータベースファイル")
+    parser.add_argument('--keep-quarters', type=int, default=KEEP_QUARTERS, help="本体に残す四半期の数（今期を含む）")
+    parser.add_argument('--dry-run', action='store_true', help="移す対象を表示するだけで変更しない")
+    args = parser.parse_args()
+
+    year, quarter = cutoff_quarter(args.keep_quarters)
+    quarters, count = archive(args.db, args.keep_quarters, dry_run=args.dry_run)
+    labels = ', '.join(f"{y}Q{q}" for y, q in quarters) or "なし"
+    if args.dry_run:
+        print(f"{year}Q{quarter} より前の四半期（{labels}）の {count} 行が対象です。")
+    else:
+        print(f"{year}Q{quarter} より前の四半期（{labels}）の {count} 行を {archive_file(args.db)} へ移しました。")
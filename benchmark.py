@@ -0,0 +1,391 @@
+import argparse
+import ast
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime
+
+import pandas as pd
+
+import analytics
+import db
+import ingest
+import mail_parser
+import migrate
+import planner
+import rollup
+import shards
+import snapshot
+
+# ===== ベンチマーク用データ生成 =====
+SURVEY_MONTHS = [1, 4, 7, 10]
+
+_INSERT_SQL = f'''
+    INSERT INTO mask_status ({", ".join(db.MASK_STATUS_COLUMNS)})
+    VALUES ({", ".join("?" for _ in db.MASK_STATUS_COLUMNS)})
+'''
+
+def survey_dates(n_dates, start_year=2023):
+    dates = []
+    year = start_year
+    while len(dates) < n_dates:
+        for month in SURVEY_MONTHS:
+            if len(dates) == n_dates:
+                break
+            dates.append(date(year, month, 5))
+        year += 1
+    return dates
+
+def _random_counts(rng):
+    p_active = rng.randint(50, 500)
+    s_active = rng.randint(20, 300)
+    p_no = rng.randint(0, p_active // 3)
+    s_no = rng.randint(0, s_active // 3)
+    return p_no, s_no, p_active, s_active
+
+def generate(db_file, n_stores, n_areas, n_dates, seed=0, chunk_size=50000):
+    # 店舗 × 調査日 の mask_status を持つ検証用DBを作成する
+    if os.path.exists(db_file):
+        os.remove(db_file)
+    migrate.upgrade(db_file)
+    rng = random.Random(seed)
+
+    conn = sqlite3.connect(db_file, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=OFF')
+    conn.execute('BEGIN')
+    stores = [
+        (f"店舗{i:05d}", f"地区{i % n_areas:02d}", "自店" if i % 4 == 0 else "競合")
+        for i in range(n_stores)
+    ]
+    conn.executemany('INSERT INTO store (store_name, area, type) VALUES (?, ?, ?)', stores)
+    store_ids = [row[0] for row in conn.execute('SELECT id FROM store ORDER BY id')]
+    conn.executemany(
+        'INSERT INTO store_alias (alias_key, alias, store_id) VALUES (?, ?, ?)',
+        [(name, name, store_id) for (name, _, _), store_id in zip(stores, store_ids)]
+    )
+
+    rows = []
+    for d in survey_dates(n_dates):
+        for store_id in store_ids:
+            p_no, s_no, p_active, s_active = _random_counts(rng)
+            rows.append((store_id, d.isoformat(), d.year, d.month, p_no, s_no, p_active, s_active))
+            if len(rows) >= chunk_size:
+                conn.executemany(_INSERT_SQL, rows)
+                rows = []
+    if rows:
+        conn.executemany(_INSERT_SQL, rows)
+
+    rollup.rebuild(conn)
+    conn.execute('COMMIT')
+    conn.execute('ANALYZE')
+    conn.close()
+    return [name for name, _, _ in stores]
+
+def _mask_csv(store_ids, n_rows, rng):
+    buffer = io.StringIO()
+    buffer.write(','.join(db.MASK_STATUS_COLUMNS) + '\n')
+    for i in range(n_rows):
+        p_no, s_no, _, _ = _random_counts(rng)
+        buffer.write(f"{store_ids[i % len(store_ids)]},2099/1/{1 + i % 28},2099,1,{p_no},{s_no},,\n")
+    return io.BytesIO(buffer.getvalue().encode())
+
+def _store_csv(n_rows):
+    lines = ['store_name,area,type'] + [f"追加店舗{i:05d},地区00,競合" for i in range(n_rows)]
+    return io.BytesIO(('\n'.join(lines) + '\n').encode())
+
+def _activity_mail(store_names, rng):
+    lines = []
+    for name in store_names:
+        lines += [name, "台数  稼働  比率", f"P  計  {rng.randint(50, 500)}  80%", f"S  計  {rng.randint(20, 300)}  70%", ""]
+    return '\n'.join(lines)
+
+# ===== 計測 =====
+def _time(fn, repeat):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - start)
+    return {
+        'runs': len(runs),
+        'min_s': min(runs),
+        'median_s': statistics.median(runs),
+        'mean_s': statistics.fmean(runs),
+    }
+
+# ===== 起動時間（新しいプロセスでの import 時間） =====
+def _app_imports():
+    # app.py の先頭で読み込んでいるモジュール（app.py から読み取るので import を変えても計測対象がずれない）
+    here = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(here, 'app.py'), encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            modules.append(node.module)
+    return modules
+
+def coldstart_imports():
+    app_imports = _app_imports()
+    return {
+        # 以前の app.py と同じく全ページと matplotlib / plotly を先頭で読み込む場合
+        'eager_all_pages': [
+            'streamlit', 'pandas', 'matplotlib.pyplot', 'matplotlib.font_manager', 'plotly.express',
+            'config', 'store', 'mask', 'active', 'edit', 'comment', 'db', 'analytics',
+        ],
+        # 現在の app.py: ダッシュボード初回描画（グラフ描画時に plotly を読み込む）
+        'lazy_dashboard': app_imports + ['plotly.express'],
+        # 現在の app.py: グラフのないページ（店舗登録）
+        'lazy_store_page': app_imports + ['store'],
+    }
+
+def coldstart(repeat):
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for name, modules in coldstart_imports().items():
+        code = (
+            "import time; start = time.perf_counter()\n"
+            + "".join(f"import {m}\n" for m in modules)
+            + "print(time.perf_counter() - start)"
+        )
+        runs = []
+        for _ in range(repeat):
+            out = subprocess.run([sys.executable, '-c', code], cwd=here, capture_output=True, text=True, check=True)
+            runs.append(float(out.stdout.strip().splitlines()[-1]))
+        results[name] = {
+            'runs': len(runs),
+            'min_s': min(runs),
+            'median_s': statistics.median(runs),
+            'mean_s': statistics.fmean(runs),
+        }
+    return results
+
+# ===== 再実行時間（app.py をスクリプトとして実行し直す時間） =====
+RERUN_PAGES = {'dashboard': "マスク着用率一覧", 'store_page': "店舗登録"}
+
+def rerun(repeat):
+    # 操作のたびに Streamlit が行う app.py の再実行を AppTest で計測する（DB は db.DB_FILE のものを使う）
+    from streamlit.testing.v1 import AppTest
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    app = AppTest.from_file(os.path.join(here, 'app.py'), default_timeout=120)
+    results = {'first_run': _time(app.run, 1)}
+    for name, page in RERUN_PAGES.items():
+        app.sidebar.selectbox[0].set_value(page).run()
+        results[name] = _time(app.run, repeat)
+    if app.exception:
+        raise RuntimeError(app.exception[0].value)
+    return results
+
+def _with_row_labels(df):
+    # 省メモリ化する前の作り方（日付ラベルを行ごとに文字列で持つ）
+    df = df.copy()
+    df['date_label'] = pd.to_datetime(df['date']).dt.strftime('%Y年%m月')
+    return df
+
+def _save_edits(row_ids, values):
+    # データ修正ページと同じく、読み込んだ時点の row_version を付けて update_mask_status_rows で保存する
+    rows = []
+    for row_id in row_ids:
+        with db.connection(db.row_shard(row_id)) as conn:
+            version = conn.execute('SELECT row_version FROM mask_status WHERE id = ?', (row_id,)).fetchone()[0]
+        rows.append({'id': row_id, 'row_version': version, **values})
+    return db.update_mask_status_rows(rows, list(values))
+
+def run(args):
+    db_file = args.db or os.path.join(tempfile.mkdtemp(prefix='mask_bench_'), 'mask.db')
+    rng = random.Random(args.seed)
+
+    start = time.perf_counter()
+    store_names = generate(db_file, args.stores, args.areas, args.dates, seed=args.seed)
+    generate_s = time.perf_counter() - start
+    if args.sharded:
+        # 地区別シャードに分けて計測する（MASK_SHARDED=1 と同じ構成）
+        shards.split(db_file)
+        db.SHARDED = True
+
+    # 生成したDBをアプリのデータアクセス層から使う
+    db.DB_FILE = db_file
+    results = {}
+
+    # ----- 読み取り系（非破壊、repeat 回） -----
+    def load_all():
+        return analytics.add_date_label(analytics.compact(db.get_mask_status_all()))
+
+    results['get_mask_status_all'] = _time(load_all, args.repeat)
+    df_all = load_all()
+
+    def load_rollup():
+        df = analytics.compact(db.get_rollup())
+        return df.rename(columns={'total_no_mask_sum': 'total_no_mask', 'total_active_sum': 'total_active'})
+
+    df_rollup = load_rollup()
+    results['get_rollup'] = _time(load_rollup, args.repeat)
+    results['graph_overall'] = _time(lambda: analytics.add_date_label(analytics.rate_series(df_rollup, [])), args.repeat)
+    results['graph_area_average'] = _time(lambda: analytics.add_date_label(analytics.rate_series(df_rollup, ['area'])), args.repeat)
+    results['analytics_compute_all'] = _time(lambda: analytics.compute_all(df_all), args.repeat)
+
+    # ダッシュボードの選択ごとのクエリ（planner）
+    def store_series(plan):
+        return analytics.add_date_label(analytics.rate_series(analytics.compact(planner.run(plan)), ['area', 'store_name']))
+
+    last = survey_dates(args.dates)[-1]
+    plans = {
+        'graph_area_stores': planner.area_store_series(db.get_areas()[0]),
+        'graph_store': planner.store_series(min(db.get_store_ids())),
+        'year_month_table': planner.year_month_table(last.year, last.month),
+    }
+    results['graph_area_stores'] = _time(lambda: store_series(plans['graph_area_stores']), args.repeat)
+    results['graph_store'] = _time(lambda: store_series(plans['graph_store']), args.repeat)
+    results['year_month_table'] = _time(lambda: planner.run(plans['year_month_table']), args.repeat)
+    # 同じ表を列指向スナップショットから読む場合（書き出しは計測のためここで1回だけ行う）
+    results['snapshot_build'] = _time(snapshot.build, 1)
+    results['year_month_table_snapshot'] = _time(lambda: snapshot.year_month_table(last.year, last.month), args.repeat)
+    results['grid_first_page'] = _time(lambda: db.get_mask_status_page(limit=50), args.repeat)
+
+    # フレームのメモリ使用量（SQL の結果そのまま＋行ごとの日付ラベル → 省メモリのフレーム）
+    memory = analytics.memory_report({
+        name: (_with_row_labels(raw), analytics.add_date_label(analytics.compact(raw)))
+        for name, raw in [
+            ('mask_status_all', db.get_mask_status_all()),
+            ('rollup', db.get_rollup()),
+            ('area_store_series', planner.run(plans['graph_area_stores'])),
+        ]
+    })
+
+    mail_text = _activity_mail(store_names, rng)
+    store_index = db.get_store_alias_index()
+    results['mail_parse'] = _time(lambda: mail_parser.parse_report(mail_text, store_index), args.repeat)
+
+    # ----- 書き込み系（1回ずつ） -----
+    store_ids = sorted(db.get_store_ids())
+    mask_csv = _mask_csv(store_ids, args.csv_rows, rng)
+    results['csv_import_mask_status'] = _time(lambda: ingest.ingest_mask_status(mask_csv), 1)
+    results['csv_import_mask_status']['rows'] = args.csv_rows
+
+    store_csv = _store_csv(min(args.csv_rows, 10000))
+    results['csv_import_store'] = _time(lambda: ingest.ingest_stores(store_csv), 1)
+
+    # CSV で追加した行（稼働データ未登録）がメール取り込みの対象になる
+    parsed = mail_parser.parse_report(mail_text, store_index)
+    results['mail_apply'] = _time(lambda: db.apply_active_counts(parsed['records']), 1)
+    results['mail_apply']['stores'] = len(parsed['records'])
+
+    edit_ids = [int(i) for i in df_all['id'].sample(min(args.edits, len(df_all)), random_state=args.seed)]
+
+    def edit_rows():
+        for row_id in edit_ids:
+            _save_edits([row_id], {'pachinko_no_mask': 1, 'slot_no_mask': 1})
+
+    results['edit_updates'] = _time(edit_rows, 1)
+    results['edit_updates']['rows'] = len(edit_ids)
+
+    # 複数セッションからの同時書き込み（書き込み専用スレッドでまとめてコミットされる）
+    # 同じ行を他のセッションが先に更新した場合は、データ修正ページと同じく読み直して保存し直す
+    conflicts = []
+
+    def concurrent_writes():
+        def session(worker):
+            for i in range(args.writes_per_session):
+                row_id = edit_ids[(worker * args.writes_per_session + i) % len(edit_ids)]
+                while True:
+                    try:
+                        _save_edits([row_id], {'pachinko_no_mask': 2, 'slot_no_mask': 1})
+                        break
+                    except db.ConflictError:
+                        conflicts.append(row_id)
+
+        threads = [threading.Thread(target=session, args=(w,)) for w in range(args.sessions)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    results['concurrent_writes'] = _time(concurrent_writes, 1)
+    results['concurrent_writes']['writes'] = args.sessions * args.writes_per_session
+    results['concurrent_writes']['conflicts'] = len(conflicts)
+
+    for name, result in coldstart(min(args.repeat, 3)).items():
+        results[f'coldstart_{name}'] = result
+    for name, result in rerun(args.repeat).items():
+        results[f'rerun_{name}'] = result
+
+    with sqlite3.connect(db_file) as conn:
+        row_count = conn.execute('SELECT COUNT(*) FROM mask_status').fetchone()[0]
+    if args.sharded:
+        row_count += sum(count or 0 for _, _, _, count in shards.status(db_file))
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'pandas': pd.__version__,
+            'stores': args.stores,
+            'areas': args.areas,
+            'dates': args.dates,
+            'sharded': args.sharded,
+            'mask_status_rows': row_count,
+            'generate_s': generate_s,
+            'db': db_file,
+        },
+        'memory': memory.to_dict('records'),
+        'query_plans': {**migrate.explain(db_file), **{name: planner.explain(plan) for name, plan in plans.items()}},
+        'results': results,
+    }
+
+def compare(current, previous):
+    # 前回結果との比較（median の比）を表示する
+    for name, result in current['results'].items():
+        before = previous.get('results', {}).get(name)
+        if not before:
+            print(f"{name:28s} {result['median_s'] * 1000:10.2f} ms   (new)")
+            continue
+        ratio = result['median_s'] / before['median_s'] if before['median_s'] else float('inf')
+        print(f"{name:28s} {result['median_s'] * 1000:10.2f} ms   x{ratio:.2f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="マスク管理アプリの各処理を計測します。")
+    parser.add_argument('--stores', type=int, default=200, help="店舗数")
+    parser.add_argument('--areas', type=int, default=5, help="地区数")
+    parser.add_argument('--dates', type=int, default=40, help="調査日数（四半期ごと）")
+    parser.add_argument('--csv-rows', type=int, default=20000, help="CSV取り込みの行数")
+    parser.add_argument('--edits', type=int, default=200, help="データ修正の更新件数")
+    parser.add_argument('--sessions', type=int, default=8, help="同時書き込みのセッション数")
+    parser.add_argument('--writes-per-session', type=int, default=50, help="セッションごとの書き込み回数")
+    parser.add_argument('--repeat', type=int, default=5, help="読み取り系の繰り返し回数")
+    parser.add_argument('--sharded', action='store_true', help="地区別シャードに分けて計測する")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--db', help="生成先のDBファイル（省略時は一時ディレクトリ）")
+    parser.add_argument('--out', default='bench_results.json', help="結果のJSONファイル")
+    parser.add_argument('--compare', help="比較対象の過去の結果JSON")
+    args = parser.parse_args()
+
+    report = run(args)
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(report, json.load(f))
+    else:
+        for name, result in report['results'].items():
+            print(f"{name:28s} {result['median_s'] * 1000:10.2f} ms")
+    for entry in report['memory']:
+        print(
+            f"memory {entry['name']:21s} {entry['before_bytes'] / 1024:10.1f} KB -> "
+            f"{entry['after_bytes'] / 1024:10.1f} KB   ({entry['rows']} 行)"
+        )
+    print(f"結果を {args.out} に保存しました（mask_status {report['meta']['mask_status_rows']} 行）。")
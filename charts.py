@@ -0,0 +1,38 @@
+import threading
+from collections import OrderedDict
+import streamlit as st
+import profiling
+
+# ===== グラフ作成（Plotly は初回描画時に読み込む） =====
+def line(df, **kwargs):
+    import plotly.express as px
+    return px.line(df, **kwargs)
+
+# ===== 図のキャッシュ（全セッション共有） =====
+# キーは (グラフ表示方法, 選択中の地区・店舗, データバージョン)。Y軸の変更はレイアウトだけを書き換える
+MAX_FIGURES = 32
+
+_figures = OrderedDict()
+_figures_lock = threading.Lock()
+
+def _get_figure(key, build_df, line_kwargs):
+    with _figures_lock:
+        entry = _figures.get(key)
+        if entry is not None:
+            _figures.move_to_end(key)
+            return entry
+
+    with profiling.timer('chart', f"{key[0]} 作成"):
+        entry = (line(build_df(), **line_kwargs), threading.Lock())
+    with _figures_lock:
+        _figures[key] = entry
+        while len(_figures) > MAX_FIGURES:
+            _figures.popitem(last=False)
+    return entry
+
+def plot_line(key, build_df, y_range, **line_kwargs):
+    # build_df はキャッシュにない場合だけ呼び出される
+    fig, fig_lock = _get_figure(key, build_df, line_kwargs)
+    with fig_lock, profiling.timer('chart', f"{key[0]} 描画"):
+        fig.update_layout(yaxis_range=list(y_range))
+        st.plotly_chart(fig, use_container_width=True)
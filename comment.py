@@ -1,35 +1,50 @@
 import streamlit as st
-import sqlite3
-import pandas as pd
 from datetime import datetime
+import db
+import profiling
 
-DB_FILE = 'mask.db'
+PAGE_SIZE = 20
 
-# ===== DB接続 =====
-def get_connection():
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
+# ===== コメント一覧（ページ単位でDBから取得） =====
+@st.fragment
+def comment_list(key, year=None, month_from=None, month_to=None, query=None):
+    # ページ送りではフラグメントだけが再実行されるため、ここでも再実行として計測する
+    with profiling.rerun(f"コメント一覧（{key}）"):
+        _comment_list(key, year, month_from, month_to, query)
+
+def _comment_list(key, year, month_from, month_to, query):
+    # 条件が変わったら先頭ページに戻す
+    filters = (year, month_from, month_to, query)
+    if st.session_state.get(f"{key}_filters") != filters:
+        st.session_state[f"{key}_filters"] = filters
+        st.session_state[f"{key}_cursors"] = [None]
+    cursors = st.session_state[f"{key}_cursors"]
+
+    df, has_next = db.get_comment_page(*filters, after=cursors[-1], limit=PAGE_SIZE)
+
+    if df.empty and len(cursors) == 1:
+        st.info("登録されたコメントはありません")
+        return
+
+    df_display = df[['year', 'month', 'comment']].copy()
+    df_display.columns = ["西暦", "月", "コメント"]
+    st.dataframe(df_display, use_container_width=True, hide_index=True)
+
+    next_cursor = (df.iloc[-1]['created_at'], int(df.iloc[-1]['id'])) if has_next else None
+
+    if has_next or len(cursors) > 1:
+        col_prev, col_page, col_next = st.columns([1, 2, 1])
+        with col_prev:
+            st.button("前へ", disabled=len(cursors) == 1, key=f"{key}_prev", on_click=cursors.pop)
+        with col_page:
+            st.caption(f"{len(cursors)} ページ目（{PAGE_SIZE} 件ずつ表示）")
+        with col_next:
+            st.button("次へ", disabled=not has_next, key=f"{key}_next", on_click=cursors.append, args=(next_cursor,))
 
 # ===== コメント表示・操作ページ =====
 def comment_page():
     st.title("コメント管理ページ")
 
-    conn = get_connection()
-    cur = conn.cursor()
-
-    # ===== テーブルがなければ作成 =====
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS comments (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            year INTEGER,
-            month INTEGER,
-            comment TEXT,
-            created_at TEXT
-        )
-    ''')
-    conn.commit()
-
     # ===== 新規登録 or 修正の切り替え =====
     mode = st.radio("操作を選択", ("新規登録", "修正"))
 
@@ -43,51 +58,36 @@ def comment_page():
             month = today.month
             created_at = today.strftime('%Y-%m-%d %H:%M:%S')
 
-            conn.execute("INSERT INTO comments (year, month, comment, created_at) VALUES (?, ?, ?, ?)",
-                         (year, month, new_comment, created_at))
-            conn.commit()
+            db.insert_comment(year, month, new_comment, created_at)
             st.success("コメントを登録しました")
 
     elif mode == "修正":
         st.subheader("既存コメントの修正")
-        df = pd.read_sql_query("SELECT * FROM comments ORDER BY created_at DESC", conn)
+        search = st.text_input("修正するコメントを検索（空欄で最新のコメント）", key="comment_edit_search")
+        df, _ = db.get_comment_page(query=search.strip() or None, limit=50)
 
         if df.empty:
-            st.info("コメントが登録されていません")
+            st.info("該当するコメントがありません")
         else:
-            df['表示'] = df['year'].astype(str) + "年" + df['month'].astype(str) + "月：" + df['comment'].str.slice(0, 20)
-            selected_row = st.selectbox("修正するコメントを選択", df['表示'])
-            selected_id = df.loc[df['表示'] == selected_row, 'id'].values[0]
+            labels = dict(zip(
+                df['id'],
+                df['year'].astype(str) + "年" + df['month'].astype(str) + "月：" + df['comment'].str.slice(0, 20)
+            ))
+            selected_id = st.selectbox("修正するコメントを選択", list(labels), format_func=labels.get)
             selected_comment = df.loc[df['id'] == selected_id, 'comment'].values[0]
 
             edited_comment = st.text_area("コメントを修正", value=selected_comment, height=150)
 
             if st.button("更新する"):
-                conn.execute("UPDATE comments SET comment = ? WHERE id = ?", (edited_comment, selected_id))
-                conn.commit()
+                db.update_comment(int(selected_id), edited_comment)
                 st.success("コメントを更新しました")
 
     # ===== 表示一覧 =====
     st.subheader("コメント一覧")
-    df = pd.read_sql_query("SELECT year, month, comment FROM comments ORDER BY created_at DESC", conn)
+    query = st.text_input("コメントを検索（スペース区切りで複数語）", key="comment_search")
+    comment_list("comment_page_list", query=query.strip() or None)
 
-    if df.empty:
-        st.info("登録されたコメントはありません")
-    else:
-        df.columns = ["西暦", "月", "コメント"]
-        st.dataframe(df, use_container_width=True)
-
-    conn.close()
-
-def show_comments():
-    st.subheader("コメント一覧")
-
-    conn = get_connection()
-    df = pd.read_sql_query("SELECT year, month, comment FROM comments ORDER BY created_at DESC", conn)
-    conn.close()
-
-    if df.empty:
-        st.info("登録されたコメントはありません")
-    else:
-        df.columns = ["西暦", "月", "コメント"]
-        st.dataframe(df, use_container_width=True)
+def show_comments(year, month):
+    # 年月指定の表と同じ期間（調査月から3か月間）のコメントを表示する
+    st.subheader(f"コメント一覧（{year}年{month}〜{month + 2}月）")
+    comment_list("dashboard_comments", year=year, month_from=month, month_to=month + 2)
@@ -0,0 +1,1050 @@
+import heapq
+import itertools
+import os
+import sqlite3
+import threading
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+import pandas as pd
+import archive
+import migrate
+import rollup
+import profiling
+import shards
+from migrate import normalize_date, normalize_store_name
+
+# ===== DB接続設定 =====
+DB_FILE = 'mask.db'
+POOL_SIZE = 8
+BUSY_TIMEOUT_MS = 5000
+MMAP_SIZE = 256 * 1024 * 1024
+CACHED_STATEMENTS = 256
+# IN 句1回あたりのパラメータ数（rollup.refresh_dates の日付の分割にも使う）
+MAX_PARAMS = 500
+
+# 地区別シャード（MASK_SHARDED=1）。mask_status と集計テーブルを地区ごとのファイルに分ける
+SHARDED = shards.ENABLED
+FAN_OUT_WORKERS = 8
+
+# ===== コネクションプール（プロセス内で共有） =====
+class _Pool:
+    # 1つのDBファイルのコネクションを最大 size 本まで作って使い回す
+    def __init__(self, open_fn, size):
+        self._open = open_fn
+        self._size = size
+        self._queue = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+
+    def acquire(self):
+        try:
+            return self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self._size
+            if create:
+                self._created += 1
+        if create:
+            try:
+                return self._open()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._queue.get()
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._queue.put(conn)
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+_shards_ready = set()
+
+def _ensure_schema():
+    # 初回接続時にスキーマを最新版へ更新する
+    global _schema_ready
+    with _schema_lock:
+        if not _schema_ready:
+            migrate.upgrade(DB_FILE)
+            if SHARDED:
+                _check_split()
+            _schema_ready = True
+
+def _check_split():
+    # シャード構成では本体の mask_status は読まないため、移行前のデータが残っていれば起動しない
+    conn = sqlite3.connect(DB_FILE, factory=profiling.connection_factory())
+    try:
+        remaining = conn.execute(
+            'SELECT EXISTS (SELECT 1 FROM mask_status WHERE store_id IN (SELECT id FROM store))'
+        ).fetchone()[0]
+    finally:
+        conn.close()
+    if remaining:
+        raise RuntimeError("MASK_SHARDED=1 で使う前に python shards.py --split で既存データを地区別シャードへ移してください。")
+
+def _ensure_shard(shard_no):
+    _ensure_schema()
+    with _schema_lock:
+        if shard_no not in _shards_ready:
+            shards.ensure(DB_FILE, shard_no)
+            _shards_ready.add(shard_no)
+
+def _open_connection(db_file):
+    conn = sqlite3.connect(
+        db_file,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        isolation_level='IMMEDIATE',
+        check_same_thread=False,
+        cached_statements=CACHED_STATEMENTS,
+        factory=profiling.connection_factory(),
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA mmap_size={MMAP_SIZE}')
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+    return conn
+
+def _open_main():
+    if not _schema_ready:
+        _ensure_schema()
+    return _open_connection(DB_FILE)
+
+def _open_shard(shard_no):
+    # シャードのファイルを開き、本体を ATTACH する（store などは本体のテーブルを参照する）
+    if shard_no not in _shards_ready:
+        _ensure_shard(shard_no)
+    conn = _open_connection(shards.shard_file(DB_FILE, shard_no))
+    conn.execute(f'ATTACH DATABASE ? AS {shards.ATTACH_NAME}', (DB_FILE,))
+    return conn
+
+_pool = _Pool(_open_main, POOL_SIZE)
+_shard_pools = {}
+_shard_pools_lock = threading.Lock()
+
+def _get_pool(shard_no):
+    if shard_no is None:
+        return _pool
+    with _shard_pools_lock:
+        pool = _shard_pools.get(shard_no)
+        if pool is None:
+            pool = _shard_pools[shard_no] = _Pool(lambda: _open_shard(shard_no), POOL_SIZE)
+        return pool
+
+@contextmanager
+def connection(shard_no=None):
+    # shard_no を指定するとそのシャードのコネクションを使う
+    pool = _get_pool(shard_no)
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+# ===== 書き込み専用スレッド（全セッションの書き込みをまとめてコミット） =====
+# 書き込みはDBファイルごとに1本のスレッドと専用コネクションで直列に実行し、待っている書き込みを
+# 最大 MAX_GROUP_COMMIT 件まで1トランザクションにまとめる（各書き込みは SAVEPOINT で分離）
+MAX_GROUP_COMMIT = 64
+
+class _Writer:
+    def __init__(self, name, open_fn, begin):
+        self.name = name
+        self._open = open_fn
+        self._begin = begin
+        self._queue = queue.Queue()
+        self._thread = None
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._conn = self._open()
+                self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+                self._thread.start()
+
+    def submit(self, fn):
+        # fn(conn) を書き込み専用スレッドで実行し、コミット後に結果が入る Future を返す
+        future = Future()
+        if threading.current_thread() is self._thread:
+            # 書き込み処理の中から呼ばれた場合は同じトランザクションで実行する
+            try:
+                future.set_result(fn(self._conn))
+            except BaseException as e:
+                future.set_exception(e)
+            return future
+        self._ensure_started()
+        self._queue.put((fn, future, profiling.current()))
+        return future
+
+    def _next_group(self):
+        group = [self._queue.get()]
+        while len(group) < MAX_GROUP_COMMIT:
+            try:
+                group.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return group
+
+    def _loop(self):
+        while True:
+            group = self._next_group()
+            try:
+                done = _run_group(self._conn, group, self._begin)
+            except BaseException as e:
+                # BEGIN の失敗など。まだ完了していない書き込みにだけ例外を返す
+                done = []
+                for _, future, _ in group:
+                    if not future.done():
+                        future.set_exception(e)
+            for future, result in done:
+                future.set_result(result)
+            if done:
+                for hook in list(_commit_hooks):
+                    hook()
+
+def _run_group(conn, group, begin):
+    # 戻り値: (future, 結果) のリスト（失敗した書き込みは future に例外を設定済み）
+    done = []
+    conn.execute(begin)
+    try:
+        for fn, future, stats in group:
+            if not future.set_running_or_notify_cancel():
+                continue
+            conn.execute('SAVEPOINT write_job')
+            try:
+                with profiling.attached(stats):
+                    result = fn(conn)
+            except BaseException as e:
+                conn.execute('ROLLBACK TO write_job')
+                conn.execute('RELEASE write_job')
+                future.set_exception(e)
+                continue
+            conn.execute('RELEASE write_job')
+            done.append((future, result))
+        if done:
+            bump_data_version(conn)
+        conn.commit()
+    except BaseException as e:
+        conn.rollback()
+        for future, _ in done:
+            future.set_exception(e)
+        return []
+    return done
+
+# コミット後に書き込み専用スレッドから呼ぶ関数（snapshot の書き出し要求など。すぐ戻ること）
+_commit_hooks = []
+
+def add_commit_hook(fn):
+    if fn not in _commit_hooks:
+        _commit_hooks.append(fn)
+
+_writer = _Writer('db-writer', _open_main, 'BEGIN IMMEDIATE')
+_shard_writers = {}
+
+def _get_writer(shard_no):
+    if shard_no is None:
+        return _writer
+    with _shard_pools_lock:
+        writer = _shard_writers.get(shard_no)
+        if writer is None:
+            # IMMEDIATE は ATTACH した本体まで書き込みロックするため、シャードは最初の書き込みでロックを取る
+            # （シャードに書き込むのはこのスレッドだけなので待ちは発生しない）
+            writer = _shard_writers[shard_no] = _Writer(f'db-writer-shard{shard_no}', lambda: _open_shard(shard_no), 'BEGIN')
+        return writer
+
+def submit_write(fn, shard_no=None):
+    # execute_write と同じ処理を待たずに Future で返す（複数シャードへの並列書き込み用）
+    return _get_writer(shard_no).submit(fn)
+
+def execute_write(fn, shard_no=None):
+    # fn(conn) を書き込み専用スレッドで1トランザクション内で実行し、コミットを待って結果を返す
+    return submit_write(fn, shard_no).result()
+
+# ===== 地区別シャードへの振り分け =====
+_fan_out_executor = None
+
+def get_shard_numbers():
+    with connection() as conn:
+        return [row[0] for row in conn.execute('SELECT shard_no FROM mask_shard ORDER BY shard_no')]
+
+def fan_out(fn, shard_nos=None):
+    # fn(conn) を各シャード（省略時は全シャード）で並列に実行し、シャード番号順の結果のリストを返す
+    global _fan_out_executor
+    shard_nos = get_shard_numbers() if shard_nos is None else shard_nos
+    with _shard_pools_lock:
+        if _fan_out_executor is None:
+            _fan_out_executor = ThreadPoolExecutor(max_workers=FAN_OUT_WORKERS, thread_name_prefix='db-shard')
+    stats = profiling.current()
+
+    def _run(shard_no):
+        with profiling.attached(stats), connection(shard_no) as conn:
+            return fn(conn)
+
+    return list(_fan_out_executor.map(_run, shard_nos))
+
+def _load_store_shards():
+    with connection() as conn:
+        return {row[0]: row[1] for row in conn.execute(
+            'SELECT s.id, m.shard_no FROM store s JOIN mask_shard m ON m.area = s.area'
+        )}
+
+def _assign_store_shard(conn, store_id):
+    row = conn.execute('SELECT area FROM store WHERE id = ?', (store_id,)).fetchone()
+    if row is None:
+        raise ValueError(f"店舗が見つかりません: {store_id}")
+    return shards.assign(conn, row[0])
+
+def store_shard(store_id, create=True):
+    # 店舗の地区のシャード番号（非シャード構成では None）。create=True なら未作成の地区のシャードを作る
+    if not SHARDED:
+        return None
+    shard_no = cached('db.store_shards', _load_store_shards).get(store_id)
+    if shard_no is None and create:
+        shard_no = execute_write(lambda conn: _assign_store_shard(conn, store_id))
+    return shard_no
+
+def row_shard(row_id):
+    # mask_status の行IDのシャード番号（非シャード構成では None）
+    return shards.shard_of_id(row_id) if SHARDED else None
+
+def _is_registered_shard(shard_no):
+    # 行IDから求めたシャードが mask_shard に登録済みか（未登録の番号で開くと空のシャードが作られてしまう）
+    return shard_no is None or shard_no in get_shard_numbers()
+
+def _read_shards(area=None, store_id=None):
+    # 読み込み先のシャード番号のリスト（非シャード構成では None）
+    if not SHARDED:
+        return None
+    if store_id is not None:
+        shard_no = store_shard(store_id, create=False)
+        return [] if shard_no is None else [shard_no]
+    if area is not None:
+        with connection() as conn:
+            row = conn.execute('SELECT shard_no FROM mask_shard WHERE area = ?', (area,)).fetchone()
+        return [] if row is None else [row[0]]
+    return get_shard_numbers()
+
+def read_mask_status(sql, params=(), area=None, store_id=None, order=None):
+    # mask_status・mask_rollup を読むクエリを実行する。シャード構成では地区・店舗のシャードだけで実行し、
+    # 指定がなければ全シャードで並列に実行して結果を連結する（order: [(列, 昇順か)] で並べ直す）
+    shard_nos = _read_shards(area, store_id)
+    if not shard_nos:
+        # 非シャード構成、または該当シャードがない（本体の空の mask_status で列だけそろえる）
+        with connection() as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+    if len(shard_nos) == 1:
+        with connection(shard_nos[0]) as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+
+    frames = fan_out(lambda conn: pd.read_sql_query(sql, conn, params=params), shard_nos)
+    df = pd.concat(frames, ignore_index=True)
+    if order:
+        df = df.sort_values(
+            [column for column, _ in order], ascending=[asc for _, asc in order],
+            kind='stable', ignore_index=True
+        )
+    return df
+
+# ===== 更新カウンタ（書き込みごとに +1） =====
+def _read_data_version(conn):
+    return conn.execute('SELECT version FROM data_version WHERE id = 1').fetchone()[0]
+
+def get_data_version():
+    with connection() as conn:
+        version = _read_data_version(conn)
+    if SHARDED:
+        # 本体と全シャードの更新カウンタの合計（どのファイルに書き込んでも増える）
+        version += sum(fan_out(_read_data_version))
+    return version
+
+def bump_data_version(conn):
+    # 書き込みと同じトランザクション内で呼び出す（commit は呼び出し側）
+    conn.execute('UPDATE data_version SET version = version + 1 WHERE id = 1')
+
+# ===== クエリ結果キャッシュ（全セッション共有） =====
+_cache = {}
+_cache_lock = threading.Lock()
+
+def cached(key, loader):
+    # loader の結果を更新カウンタ単位で保持する。返した値は共有されるため変更しないこと
+    version = get_data_version()
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+
+    value = loader()
+    with _cache_lock:
+        _cache[key] = (version, value)
+    return value
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+# ===== 店舗 =====
+def get_store_all():
+    with connection() as conn:
+        return pd.read_sql_query('SELECT * FROM store ORDER BY id', conn)
+
+def get_store_names():
+    with connection() as conn:
+        return pd.read_sql_query('SELECT id, store_name FROM store ORDER BY store_name', conn)
+
+_INSERT_ALIAS_SQL = 'INSERT OR IGNORE INTO store_alias (alias_key, alias, store_id) VALUES (?, ?, ?)'
+
+def insert_store(store_name, area, store_type):
+    # 店舗名（正規化後）がほかの店舗の店舗名・別名として登録済みなら ValueError（CSV取り込みと同じ扱い）
+    key = normalize_store_name(store_name)
+
+    def _insert(conn):
+        owner = conn.execute(
+            'SELECT s.store_name FROM store_alias a JOIN store s ON a.store_id = s.id WHERE a.alias_key = ?', (key,)
+        ).fetchone()
+        if owner is not None:
+            raise ValueError(f"「{store_name.strip()}」は店舗名（または別名）が登録済みです（店舗「{owner[0]}」）。")
+        store_id = conn.execute(
+            'INSERT INTO store (store_name, area, type) VALUES (?, ?, ?)',
+            (store_name, area, store_type)
+        ).lastrowid
+        conn.execute(_INSERT_ALIAS_SQL, (key, key, store_id))
+        return store_id
+
+    return execute_write(_insert)
+
+def insert_store_chunks(chunks):
+    # chunks: (store_name, area, type) のリストを順に返すイテレータ。全体を1トランザクションで登録する
+    # CSV の読み込みと検証はここ（呼び出し側のスレッド）で済ませ、書き込みスレッドには出来上がった行だけを渡す
+    # （書き込みスレッドでファイルを読むと、その間ほかのセッションの書き込みが止まる）
+    chunks = list(chunks)
+
+    def _insert(conn):
+        last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM store').fetchone()[0]
+        count = 0
+        for rows in chunks:
+            conn.executemany('INSERT INTO store (store_name, area, type) VALUES (?, ?, ?)', rows)
+            count += len(rows)
+        # 登録した店舗名を別名として登録する
+        aliases = []
+        for store_id, store_name in conn.execute('SELECT id, store_name FROM store WHERE id > ? ORDER BY id', (last_id,)):
+            key = normalize_store_name(store_name)
+            aliases.append((key, key, store_id))
+        conn.executemany(_INSERT_ALIAS_SQL, aliases)
+        return count
+
+    return execute_write(_insert)
+
+def get_store_ids():
+    with connection() as conn:
+        return {row[0] for row in conn.execute('SELECT id FROM store')}
+
+def _refresh_store_rollup(conn, store_id):
+    dates = [row[0] for row in conn.execute(
+        'SELECT DISTINCT date FROM mask_status WHERE store_id = ?', (store_id,)
+    )]
+    rollup.refresh_dates(conn, dates)
+
+def delete_store(store_id):
+    shard_no = store_shard(store_id, create=False)
+
+    def _delete(conn):
+        conn.execute('DELETE FROM store_alias WHERE store_id = ?', (store_id,))
+        count = conn.execute('DELETE FROM store WHERE id = ?', (store_id,)).rowcount
+        if not SHARDED:
+            _refresh_store_rollup(conn, store_id)
+        return count
+
+    count = execute_write(_delete)
+    if shard_no is not None:
+        # シャード構成では店舗を消した後に、その地区のシャードの集計を作り直す
+        execute_write(lambda conn: _refresh_store_rollup(conn, store_id), shard_no)
+    return count
+
+# ===== 店舗の別名（正規化した名前 → 店舗ID） =====
+def _load_store_alias_index():
+    with connection() as conn:
+        return {row[0]: row[1] for row in conn.execute('SELECT alias_key, store_id FROM store_alias')}
+
+def get_store_alias_index():
+    # メール取り込み・CSV取り込みで共有する。キーは normalize_store_name で作る
+    return cached('db.store_alias_index', _load_store_alias_index)
+
+def get_store_aliases():
+    with connection() as conn:
+        return pd.read_sql_query('''
+            SELECT a.alias, s.store_name, s.area, a.store_id
+            FROM store_alias a
+            JOIN store s ON a.store_id = s.id
+            ORDER BY s.area, s.store_name, a.alias
+        ''', conn)
+
+def _store_named(conn, key):
+    # 店舗名そのもの（正規化後）が key の店舗 (ID, 店舗名)。なければ None
+    for store_id, store_name in conn.execute('SELECT id, store_name FROM store ORDER BY id'):
+        if normalize_store_name(store_name) == key:
+            return store_id, store_name
+    return None
+
+def set_store_alias(alias, store_id):
+    # 同じ別名が登録済みの場合は紐付け先を変更する。ほかの店舗の店舗名は付け替えない
+    key = normalize_store_name(alias)
+
+    def _set(conn):
+        owner = _store_named(conn, key)
+        if owner is not None and owner[0] != store_id:
+            raise ValueError(f"「{alias.strip()}」は店舗「{owner[1]}」の店舗名のため、ほかの店舗の別名にはできません。")
+        conn.execute(
+            'INSERT OR REPLACE INTO store_alias (alias_key, alias, store_id) VALUES (?, ?, ?)',
+            (key, alias.strip(), store_id)
+        )
+
+    execute_write(_set)
+
+def delete_store_alias(alias):
+    # 店舗名そのものの登録は消さない（メール・CSV取り込みで店舗名が引けなくなるため）
+    key = normalize_store_name(alias)
+
+    def _delete(conn):
+        owner = _store_named(conn, key)
+        if owner is not None:
+            raise ValueError(f"「{alias}」は店舗「{owner[1]}」の店舗名のため削除できません。")
+        return conn.execute('DELETE FROM store_alias WHERE alias_key = ?', (key,)).rowcount
+
+    return execute_write(_delete)
+
+# ===== マスク着用データ =====
+# 保存するのは人数だけ。合計と着用率（0〜1）は mask_status の生成列で計算される
+MASK_STATUS_COLUMNS = [
+    'store_id', 'date', 'year', 'month',
+    'pachinko_no_mask', 'slot_no_mask',
+    'pachinko_active', 'slot_active'
+]
+COUNT_COLUMNS = ['pachinko_no_mask', 'slot_no_mask', 'pachinko_active', 'slot_active']
+
+_INSERT_MASK_STATUS_SQL = f'''
+    INSERT INTO mask_status ({", ".join(MASK_STATUS_COLUMNS)})
+    VALUES ({", ".join("?" for _ in MASK_STATUS_COLUMNS)})
+'''
+
+_MASK_STATUS_ALL_SQL = '''
+    SELECT ms.id, s.store_name, ms.date, ms.year, ms.month,
+           ms.pachinko_no_mask, ms.slot_no_mask, ms.total_no_mask,
+           ms.pachinko_active, ms.slot_active, ms.total_active,
+           ms.pachinko_mask_rate, ms.slot_mask_rate, ms.total_mask_rate,
+           s.area, s.type
+    FROM mask_status ms
+    JOIN store s ON ms.store_id = s.id
+    ORDER BY ms.date DESC, ms.store_id
+'''
+
+def get_mask_status_all():
+    return read_mask_status(_MASK_STATUS_ALL_SQL, order=[('date', False)])
+
+def _mask_status_filter(store_id=None, area=None, date_from=None, date_to=None, year=None, month=None):
+    # 一覧・エクスポート共通の絞り込み条件（WHERE 句の条件とパラメータのリスト）
+    conditions = []
+    params = []
+    if store_id is not None:
+        conditions.append('ms.store_id = ?')
+        params.append(store_id)
+    if area is not None:
+        conditions.append('ms.store_id IN (SELECT id FROM store WHERE area = ?)')
+        params.append(area)
+    if date_from is not None:
+        conditions.append('ms.date >= ?')
+        params.append(date_from)
+    if date_to is not None:
+        conditions.append('ms.date <= ?')
+        params.append(date_to)
+    if year is not None:
+        conditions.append('ms.year = ?')
+        params.append(int(year))
+    if month is not None:
+        conditions.append('ms.month = ?')
+        params.append(int(month))
+    return conditions, params
+
+def get_mask_status_page(store_id=None, area=None, date_from=None, date_to=None, after=None, limit=50):
+    # (date, id) の降順でキーセットページングする。after は前ページ最終行の (date, id)
+    conditions, params = _mask_status_filter(store_id, area, date_from, date_to)
+    if after is not None:
+        conditions.append('(ms.date, ms.id) < (?, ?)')
+        params.extend(after)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    # シャード構成では各シャードから1ページ分ずつ取得して並べ直す
+    df = read_mask_status(f'''
+        SELECT ms.id, s.store_name, ms.date, ms.year, ms.month,
+               ms.pachinko_no_mask, ms.slot_no_mask, ms.total_no_mask,
+               ms.pachinko_active, ms.slot_active, ms.total_active,
+               ms.pachinko_mask_rate, ms.slot_mask_rate, ms.total_mask_rate,
+               s.area, s.type
+        FROM mask_status ms
+        JOIN store s ON ms.store_id = s.id
+        {where}
+        ORDER BY ms.date DESC, ms.id DESC
+        LIMIT ?
+    ''', params + [limit + 1], area=area, store_id=store_id, order=[('date', False), ('id', False)])
+
+    # 1件多く取得して次ページの有無を判定する
+    has_next = len(df) > limit
+    return df.iloc[:limit], has_next
+
+# ===== エクスポート（全件を DataFrame にせず、カーソルから少しずつ読む） =====
+EXPORT_CHUNK_SIZE = 2000
+
+_EXPORT_SQL = '''
+    SELECT ms.id, s.store_name, s.area, s.type, ms.date, ms.year, ms.month,
+           ms.pachinko_no_mask, ms.slot_no_mask, ms.total_no_mask,
+           ms.pachinko_active, ms.slot_active, ms.total_active,
+           ms.pachinko_mask_rate, ms.slot_mask_rate, ms.total_mask_rate
+    FROM mask_status ms
+    JOIN store s ON ms.store_id = s.id
+    {where}
+    ORDER BY ms.date DESC, ms.id DESC
+'''
+
+def _fetch_rows(cursor, chunk_size):
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield from rows
+
+def _iter_rows(shard_no, sql, params, chunk_size):
+    # 読み終わる（またはジェネレータが閉じられる）までコネクションを借りたままにする
+    with connection(shard_no) as conn:
+        yield from _fetch_rows(conn.execute(sql, params), chunk_size)
+
+def _iter_archived_rows(sql, params, chunk_size):
+    # アーカイブ済みの四半期の明細（archive.py で移した行）。店舗は本体を ATTACH して参照する
+    path = archive.archive_file(DB_FILE)
+    if not os.path.exists(path):
+        return
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, factory=profiling.connection_factory())
+    try:
+        conn.row_factory = sqlite3.Row
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'mask_status'").fetchone():
+            return
+        conn.execute(f'ATTACH DATABASE ? AS {shards.ATTACH_NAME}', (DB_FILE,))
+        yield from _fetch_rows(conn.execute(sql, params), chunk_size)
+    finally:
+        conn.close()
+
+def iter_mask_status(store_id=None, area=None, date_from=None, date_to=None, year=None, month=None,
+                     chunk_size=EXPORT_CHUNK_SIZE):
+    # 絞り込んだ明細を (date, id) の降順で chunk_size 行ずつのリストにして返すジェネレータ
+    # アーカイブ済みの行は本体のどの行よりも古いため、本体の後に続けて返す
+    conditions, params = _mask_status_filter(store_id, area, date_from, date_to, year, month)
+    sql = _EXPORT_SQL.format(where=f"WHERE {' AND '.join(conditions)}" if conditions else '')
+    shard_nos = _read_shards(area, store_id)
+    if not shard_nos:
+        rows = _iter_rows(None, sql, params, chunk_size)
+    else:
+        # シャード構成では各シャードのカーソルを並び順のまま併合する
+        rows = heapq.merge(
+            *(_iter_rows(shard_no, sql, params, chunk_size) for shard_no in shard_nos),
+            key=lambda row: (row['date'], row['id']), reverse=True
+        )
+    rows = itertools.chain(rows, _iter_archived_rows(sql, params, chunk_size))
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def get_mask_status_counts(date_from=None, date_to=None, area=None):
+    # 集計用に人数の列だけを取得する（日付は YYYY-MM-DD の範囲指定）
+    # アーカイブ済みの四半期は店舗ごとの四半期集計（その四半期の最後の調査日に1行）を返す
+    conditions = []
+    params = []
+    if date_from is not None:
+        conditions.append('{t}.date >= ?')
+        params.append(date_from)
+    if date_to is not None:
+        conditions.append('{t}.date <= ?')
+        params.append(date_to)
+    if area is not None:
+        conditions.append('s.area = ?')
+        params.append(area)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    return read_mask_status(f'''
+        SELECT s.area, s.store_name, q.date, q.total_no_mask, q.total_active
+        FROM mask_quarterly q
+        JOIN store s ON q.store_id = s.id
+        {where.format(t='q')}
+        UNION ALL
+        SELECT s.area, s.store_name, ms.date, ms.total_no_mask, ms.total_active
+        FROM mask_status ms
+        JOIN store s ON ms.store_id = s.id
+        {where.format(t='ms')}
+        ORDER BY date
+    ''', params * 2, area=area, order=[('date', True)])
+
+def get_areas():
+    with connection() as conn:
+        return [row[0] for row in conn.execute('SELECT DISTINCT area FROM store ORDER BY area')]
+
+def get_mask_status_slice(store_id, date_from=None, date_to=None):
+    # データ修正用。店舗×期間の行を行バージョン付きで取得する
+    conditions = ['store_id = ?']
+    params = [store_id]
+    if date_from is not None:
+        conditions.append('date >= ?')
+        params.append(date_from)
+    if date_to is not None:
+        conditions.append('date <= ?')
+        params.append(date_to)
+
+    return read_mask_status(f'''
+        SELECT id, date,
+               pachinko_no_mask, slot_no_mask, total_no_mask,
+               pachinko_active, slot_active, total_active,
+               pachinko_mask_rate, slot_mask_rate, total_mask_rate,
+               row_version
+        FROM mask_status
+        WHERE {' AND '.join(conditions)}
+        ORDER BY date DESC, id DESC
+    ''', params, store_id=store_id)
+
+def _with_iso_date(values):
+    values = list(values)
+    values[1] = normalize_date(values[1])
+    return values
+
+def _row_date(conn, row_id):
+    row = conn.execute('SELECT date FROM mask_status WHERE id = ?', (row_id,)).fetchone()
+    return row[0] if row else None
+
+def insert_mask_status(values):
+    # values: MASK_STATUS_COLUMNS 順のタプル（日付は YYYY-MM-DD に正規化して保存）
+    values = _with_iso_date(values)
+
+    def _insert(conn):
+        conn.execute(_INSERT_MASK_STATUS_SQL, values)
+        rollup.refresh_dates(conn, [values[1]])
+
+    execute_write(_insert, store_shard(values[0]))
+
+def _insert_chunks(conn, chunks):
+    count = 0
+    dates = set()
+    for rows in chunks:
+        conn.executemany(_INSERT_MASK_STATUS_SQL, rows)
+        dates.update(row[1] for row in rows)
+        count += len(rows)
+    rollup.refresh_dates(conn, dates)
+    return count
+
+def insert_mask_status_chunks(chunks):
+    # chunks: MASK_STATUS_COLUMNS 順の行リストを順に返すイテレータ（日付は正規化済み）
+    # insert_store_chunks と同じく、読み込みと検証を済ませてから書き込みスレッドへ渡す
+    chunks = list(chunks)
+    if not SHARDED:
+        return execute_write(lambda conn: _insert_chunks(conn, chunks))
+
+    # シャード構成では地区ごとに行を分け、各シャードの書き込みスレッドで並列に登録する（地区ごとに1トランザクション）
+    shard_of = {}
+    by_shard = {}
+    for rows in chunks:
+        for row in rows:
+            if row[0] not in shard_of:
+                shard_of[row[0]] = store_shard(row[0])
+            by_shard.setdefault(shard_of[row[0]], []).append(row)
+    futures = [
+        submit_write(lambda conn, rows=rows: _insert_chunks(conn, [rows]), shard_no)
+        for shard_no, rows in by_shard.items()
+    ]
+    return sum(future.result() for future in futures)
+
+class ConflictError(Exception):
+    # 読み込み後に他の更新があった行（ids）がある場合に送出する
+    def __init__(self, ids):
+        super().__init__(f"他の更新と競合しました: {ids}")
+        self.ids = ids
+
+def _update_rows(conn, sql, columns, rows):
+    # 書き込み専用スレッドのトランザクション内なので、確認から更新までの間に他の書き込みは入らない
+    versions = {row['id']: row['row_version'] for row in rows}
+    ids = list(versions)
+    current = {}
+    for start in range(0, len(ids), MAX_PARAMS):
+        chunk = ids[start:start + MAX_PARAMS]
+        placeholders = ', '.join('?' for _ in chunk)
+        for row in conn.execute(
+            f'SELECT id, date, row_version FROM mask_status WHERE id IN ({placeholders})', chunk
+        ):
+            current[row['id']] = (row['date'], row['row_version'])
+    conflicts = [i for i in ids if i not in current or current[i][1] != versions[i]]
+    if conflicts:
+        raise ConflictError(conflicts)
+
+    conn.executemany(sql, [[row[c] for c in columns] + [row['id']] for row in rows])
+    rollup.refresh_dates(conn, [date for date, _ in current.values()])
+    return len(rows)
+
+def update_mask_status_rows(rows, columns):
+    # rows: id・row_version と columns の値を持つ辞書のリスト。全件を1トランザクションで更新し、
+    # 読み込み後に row_version が変わった行があれば何も更新せずに ConflictError を送出する
+    # （シャード構成では地区ごとのトランザクションになる。データ修正ページは1店舗ずつなので1つ）
+    sql = f'''
+        UPDATE mask_status
+        SET {", ".join(f"{c} = ?" for c in columns)}, row_version = row_version + 1
+        WHERE id = ?
+    '''
+    by_shard = {}
+    for row in rows:
+        by_shard.setdefault(row_shard(row['id']), []).append(row)
+    unknown = [shard_no for shard_no in by_shard if not _is_registered_shard(shard_no)]
+    if unknown:
+        # 登録されていないシャードの行は存在しない（読み込み後に削除された行と同じ扱い）
+        raise ConflictError([row['id'] for shard_no in unknown for row in by_shard[shard_no]])
+    return sum(
+        execute_write(lambda conn, rows=shard_rows: _update_rows(conn, sql, columns, rows), shard_no)
+        for shard_no, shard_rows in by_shard.items()
+    )
+
+def delete_mask_status(row_id):
+    def _delete(conn):
+        date = _row_date(conn, row_id)
+        count = conn.execute('DELETE FROM mask_status WHERE id = ?', (row_id,)).rowcount
+        rollup.refresh_dates(conn, [date])
+        return count
+
+    # 削除した件数を返す（該当する行がなければ 0）
+    shard_no = row_shard(row_id)
+    if not _is_registered_shard(shard_no):
+        return 0
+    return execute_write(_delete, shard_no)
+
+_QUARTERLY_ROLLUP_SQL = '''
+    SELECT s.area, s.type, q.date,
+           SUM(q.total_no_mask) AS total_no_mask_sum,
+           SUM(q.total_active) AS total_active_sum,
+           SUM(q.row_count) AS row_count
+    FROM mask_quarterly q
+    JOIN store s ON q.store_id = s.id
+    GROUP BY s.area, s.type, q.date
+'''
+
+def get_rollup():
+    df = read_mask_status('SELECT * FROM mask_rollup ORDER BY date', order=[('date', True)])
+    with connection() as conn:
+        history = pd.read_sql_query(_QUARTERLY_ROLLUP_SQL, conn)
+    if history.empty and not SHARDED:
+        return df
+    # アーカイブ済みの四半期の集計・シャードごとの部分集計を 地区・種別・日付 で合算する
+    return (
+        pd.concat([history, df], ignore_index=True)
+        .groupby(['area', 'type', 'date'], as_index=False)[['total_no_mask_sum', 'total_active_sum', 'row_count']]
+        .sum()
+        .sort_values('date', kind='stable', ignore_index=True)
+    )
+
+def get_archived_through():
+    # アーカイブ済みの最新の四半期 (年, 四半期)。アーカイブしていなければ None
+    with connection() as conn:
+        row = conn.execute('SELECT year, quarter FROM mask_quarterly ORDER BY year DESC, quarter DESC LIMIT 1').fetchone()
+    return (row[0], row[1]) if row else None
+
+# ===== 着用率の変化（前回調査比・前年同期比） =====
+_RATE_CHANGE_KEYS = {
+    'store': ('d.store_id', 's.store_name, s.area', 'JOIN store s ON s.id = w.key'),
+    'area': ('s.area', 'w.key AS area', ''),
+}
+
+def get_rate_changes(level, year, quarter):
+    # 四半期ごとに人数を合計し、ウィンドウ関数で前回調査・前年同期の着用率（0〜1）と比べる
+    # 前回調査は前年1月以降から探す（year/month インデックスで対象を2年分に絞る）
+    # シャード構成では店舗・地区の履歴が1つのシャードに収まるので、各シャードの結果を連結すればよい
+    key, columns, join = _RATE_CHANGE_KEYS[level]
+    # アーカイブ済みの四半期は店舗ごとの四半期集計（稼働人数が登録済みの行の人数）を使う
+    return read_mask_status(f'''
+        WITH detail AS (
+            SELECT ms.store_id, ms.year, (ms.month - 1) / 3 + 1 AS quarter,
+                   ms.total_no_mask AS no_mask, ms.total_active AS active
+            FROM mask_status ms
+            WHERE ms.year BETWEEN ? AND ? AND ms.total_active IS NOT NULL
+            UNION ALL
+            SELECT q.store_id, q.year, q.quarter, q.measured_no_mask, q.total_active
+            FROM mask_quarterly q
+            WHERE q.year BETWEEN ? AND ?
+        ), quarterly AS (
+            SELECT {key} AS key, d.year, d.quarter, SUM(d.no_mask) AS no_mask, SUM(d.active) AS active
+            FROM detail d
+            JOIN store s ON s.id = d.store_id
+            GROUP BY 1, 2, 3
+            HAVING SUM(d.active) > 0
+        ), w AS (
+            SELECT key, year, quarter,
+                   (active - no_mask) * 1.0 / active AS rate,
+                   LAG((active - no_mask) * 1.0 / active) OVER by_survey AS prev_rate,
+                   LAG(year) OVER by_survey AS prev_year,
+                   LAG(quarter) OVER by_survey AS prev_quarter,
+                   LAG((active - no_mask) * 1.0 / active) OVER by_quarter AS last_year_rate,
+                   LAG(year) OVER by_quarter AS last_year
+            FROM quarterly
+            WINDOW by_survey AS (PARTITION BY key ORDER BY year, quarter),
+                   by_quarter AS (PARTITION BY key, quarter ORDER BY year)
+        )
+        SELECT {columns}, w.rate,
+               w.prev_year, w.prev_quarter, w.rate - w.prev_rate AS change_prev,
+               CASE WHEN w.last_year = w.year - 1 THEN w.rate - w.last_year_rate END AS change_last_year
+        FROM w
+        {join}
+        WHERE w.year = ? AND w.quarter = ?
+    ''', (year - 1, year, year - 1, year, year, quarter))
+
+def _prefetch_unfilled(conn, store_counts):
+    # 稼働データ未登録の行を店舗ごとに新しい順で、必要な件数だけまとめて取得する
+    store_ids = list(store_counts)
+    targets = {}
+    for start in range(0, len(store_ids), MAX_PARAMS):
+        chunk = store_ids[start:start + MAX_PARAMS]
+        placeholders = ', '.join('?' for _ in chunk)
+        rows = conn.execute(
+            migrate.UNFILLED_ROWS_SQL.format(placeholders=placeholders),
+            chunk + [max(store_counts[store_id] for store_id in chunk)]
+        ).fetchall()
+        for row in rows:
+            if row['rn'] <= store_counts[row['store_id']]:
+                targets.setdefault(row['store_id'], []).append(row)
+    return targets
+
+def apply_active_counts(entries):
+    # entries: (店舗ID, 稼働P, 稼働S) のリスト
+    # 対象行を1回のクエリで取得し、executemany で一括更新する。(更新済み, 該当なし) を返す
+    if not entries:
+        return [], []
+
+    if not SHARDED:
+        return execute_write(lambda conn: _apply_active_counts(conn, entries))
+
+    # シャード構成では店舗の地区ごとに分け、各シャードの書き込みスレッドで並列に更新する
+    shard_of = {store_id: store_shard(store_id, create=False) for store_id, _, _ in entries}
+    by_shard = {}
+    for entry in entries:
+        by_shard.setdefault(shard_of[entry[0]], []).append(entry)
+    unmatched = [store_id for store_id, _, _ in by_shard.pop(None, [])]
+    futures = [
+        submit_write(lambda conn, entries=shard_entries: _apply_active_counts(conn, entries), shard_no)
+        for shard_no, shard_entries in by_shard.items()
+    ]
+    matched = []
+    for future in futures:
+        shard_matched, shard_unmatched = future.result()
+        matched += shard_matched
+        unmatched += shard_unmatched
+    return matched, unmatched
+
+def _apply_active_counts(conn, entries):
+    store_counts = {}
+    for store_id, _, _ in entries:
+        store_counts[store_id] = store_counts.get(store_id, 0) + 1
+
+    targets = _prefetch_unfilled(conn, store_counts)
+    updates = []
+    matched = []
+    unmatched = []
+    dates = set()
+    for store_id, p_val, s_val in entries:
+        candidates = targets.get(store_id)
+        if not candidates:
+            unmatched.append(store_id)
+            continue
+        row = candidates.pop(0)
+        updates.append((p_val, s_val, row['id']))
+        dates.add(row['date'])
+        matched.append((store_id, row['id'], row['date']))
+
+    conn.executemany('''
+        UPDATE mask_status
+        SET pachinko_active = ?, slot_active = ?, row_version = row_version + 1
+        WHERE id = ?
+    ''', updates)
+    rollup.refresh_dates(conn, dates)
+    return matched, unmatched
+
+# ===== コメント =====
+# 全文検索は3文字以上の語だけに使える（trigram）。短い語は LIKE で絞り込む
+FTS_MIN_LENGTH = 3
+
+def _comment_search_conditions(query):
+    conditions = []
+    params = []
+    terms = query.split()
+    fts_terms = [t for t in terms if len(t) >= FTS_MIN_LENGTH]
+    if fts_terms:
+        conditions.append('id IN (SELECT rowid FROM comments_fts WHERE comments_fts MATCH ?)')
+        params.append(' '.join('"' + t.replace('"', '""') + '"' for t in fts_terms))
+    for term in terms:
+        if len(term) < FTS_MIN_LENGTH:
+            escaped = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            conditions.append("comment LIKE ? ESCAPE '\\'")
+            params.append(f"%{escaped}%")
+    return conditions, params
+
+def get_comment_page(year=None, month_from=None, month_to=None, query=None, after=None, limit=20):
+    # (created_at, id) の降順でキーセットページングする。after は前ページ最終行の (created_at, id)
+    conditions = []
+    params = []
+    if year is not None:
+        conditions.append('year = ?')
+        params.append(year)
+    if month_from is not None:
+        conditions.append('month >= ?')
+        params.append(month_from)
+    if month_to is not None:
+        conditions.append('month <= ?')
+        params.append(month_to)
+    if query:
+        search_conditions, search_params = _comment_search_conditions(query)
+        conditions += search_conditions
+        params += search_params
+    if after is not None:
+        conditions.append('(created_at, id) < (?, ?)')
+        params.extend(after)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+    with connection() as conn:
+        df = pd.read_sql_query(f'''
+            SELECT id, year, month, comment, created_at
+            FROM comments
+            {where}
+            ORDER BY created_at DESC, id DESC
+            LIMIT ?
+        ''', conn, params=params + [limit + 1])
+
+    has_next = len(df) > limit
+    return df.iloc[:limit], has_next
+
+def insert_comment(year, month, comment, created_at):
+    execute_write(lambda conn: conn.execute(
+        'INSERT INTO comments (year, month, comment, created_at) VALUES (?, ?, ?, ?)',
+        (year, month, comment, created_at)
+    ))
+
+def update_comment(comment_id, comment):
+    execute_write(lambda conn: conn.execute(
+        'UPDATE comments SET comment = ? WHERE id = ?', (comment, comment_id)
+    ))
+
+# ===== グラフ設定 =====
+def get_config_values(keys):
+    with connection() as conn:
+        cur = conn.execute(
+            f'SELECT key, value FROM config WHERE key IN ({", ".join("?" for _ in keys)})',
+            list(keys)
+        )
+        return {row['key']: row['value'] for row in cur.fetchall()}
+
+def set_config_values(values):
+    execute_write(lambda conn: conn.executemany(
+        'REPLACE INTO config (key, value) VALUES (?, ?)', list(values.items())
+    ))
@@ -1,95 +1,123 @@
 import streamlit as st
-import sqlite3
 import pandas as pd
-from datetime import datetime
 import numpy as np
-
-DB_FILE = 'mask.db'
-
-def get_connection():
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
+import db
+
+# 編集できる列（合計と着用率は DB の生成列で計算される）
+EDIT_COLUMNS = db.COUNT_COLUMNS
+DISPLAY_COLUMNS = [
+    'pachinko_no_mask', 'slot_no_mask', 'total_no_mask',
+    'pachinko_active', 'slot_active', 'total_active',
+    'pachinko_mask_rate', 'slot_mask_rate', 'total_mask_rate'
+]
+COLUMN_LABELS = {
+    'date': '日付',
+    'pachinko_no_mask': '未着用P', 'slot_no_mask': '未着用S', 'total_no_mask': '未着用計',
+    'pachinko_active': '稼働P', 'slot_active': '稼働S', 'total_active': '稼働計',
+    'pachinko_mask_rate': '着用率P', 'slot_mask_rate': '着用率S', 'total_mask_rate': '着用率計',
+}
+
+def calc_rate(active, no_mask):
+    # 着用率（0〜1）。稼働人数が0または未登録の場合は NaN（DB の生成列と同じ計算）
+    active = active.astype('float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rate = (active - no_mask) / active
+    return rate.where(active > 0)
+
+def recalc(df):
+    # 変更内容の確認表示用
+    df = df.copy()
+    df['total_no_mask'] = df['pachinko_no_mask'] + df['slot_no_mask']
+    df['total_active'] = df['pachinko_active'] + df['slot_active']
+    df['pachinko_mask_rate'] = calc_rate(df['pachinko_active'], df['pachinko_no_mask'])
+    df['slot_mask_rate'] = calc_rate(df['slot_active'], df['slot_no_mask'])
+    df['total_mask_rate'] = calc_rate(df['total_active'], df['total_no_mask'])
+    return df
+
+def changed_rows(original, edited):
+    # 編集前後で値が変わった行（NaN 同士は同じ値とみなす）
+    before = original[EDIT_COLUMNS].astype('float64')
+    after = edited[EDIT_COLUMNS].astype('float64')
+    same = (before == after) | (before.isna() & after.isna())
+    return edited[~same.all(axis=1)]
+
+def _to_db_value(value):
+    if pd.isna(value):
+        return None
+    return int(value) if float(value).is_integer() else float(value)
 
 def edit_page():
     st.title("データ修正ページ")
 
-    conn = get_connection()
-    stores = pd.read_sql_query("SELECT id, store_name FROM store ORDER BY store_name", conn)
-    store_dict = dict(zip(stores['store_name'], stores['id']))
-
-    selected_store = st.selectbox("店舗を選択", stores['store_name'])
-    store_id = store_dict[selected_store]
+    # 保存結果は再読み込み後に表示する
+    message = st.session_state.pop("edit_message", None)
+    if message:
+        kind, text = message
+        getattr(st, kind)(text)
 
-    df = pd.read_sql_query(
-        "SELECT * FROM mask_status WHERE store_id = ? ORDER BY date DESC",
-        conn, params=(store_id,)
-    )
+    stores = db.get_store_names()
+    store_dict = dict(zip(stores['store_name'], stores['id']))
 
-    if df.empty:
+    col1, col2 = st.columns(2)
+    with col1:
+        selected_store = st.selectbox("店舗を選択", stores['store_name'])
+    with col2:
+        date_range = st.date_input("期間を選択（未指定で全期間）", value=(), key="edit_dates")
+    store_id = int(store_dict[selected_store])
+    date_from = date_range[0].strftime("%Y-%m-%d") if len(date_range) >= 1 else None
+    date_to = date_range[-1].strftime("%Y-%m-%d") if len(date_range) == 2 else None
+
+    # 編集開始時点の値と行バージョンを保持し、保存時の差分と競合の判定に使う
+    nonce = st.session_state.setdefault("edit_nonce", 0)
+    slice_key = (store_id, date_from, date_to, nonce)
+    if st.session_state.get("edit_slice_key") != slice_key:
+        st.session_state["edit_slice_key"] = slice_key
+        st.session_state["edit_original"] = db.get_mask_status_slice(store_id, date_from, date_to)
+    original = st.session_state["edit_original"]
+
+    if original.empty:
         st.info("この店舗のデータが見つかりません。")
         return
 
-    df['date'] = pd.to_datetime(df['date']).dt.strftime('%Y/%m/%d')
-    selected_date = st.selectbox("日付を選択", df['date'])
-    row = df[df['date'] == selected_date].iloc[0].to_dict()
-
-    st.subheader(f"{selected_date} のデータ修正")
-
-    new_values = {}
-
-    for column in ['pachinko_no_mask', 'slot_no_mask', 'pachinko_active', 'slot_active']:
-        default_val = float(row[column]) if pd.notnull(row[column]) else 0
-        new_values[column] = st.number_input(
-            column.replace('_', ' ').title(), value=default_val, step=1.0, format="%f"
-        )
+    st.subheader(f"{selected_store} のデータ修正（{len(original)} 件）")
+    edited = st.data_editor(
+        original.set_index('id')[['date'] + DISPLAY_COLUMNS],
+        column_config={
+            **{c: st.column_config.Column(COLUMN_LABELS[c], disabled=True) for c in ['date'] + DISPLAY_COLUMNS},
+            **{c: st.column_config.NumberColumn(COLUMN_LABELS[c], min_value=0, step=1) for c in EDIT_COLUMNS},
+        },
+        hide_index=True,
+        use_container_width=True,
+        key=f"edit_grid_{'_'.join(str(k) for k in slice_key)}",
+    )
 
-    new_values['total_no_mask'] = new_values['pachinko_no_mask'] + new_values['slot_no_mask']
-    new_values['total_active'] = new_values['pachinko_active'] + new_values['slot_active']
+    changes = recalc(changed_rows(original.set_index('id'), edited))
+    if changes.empty:
+        st.info("変更はありません。表の未着用・稼働の値を直接編集してください。")
+        return
 
-    def calc_rate(active, no_mask):
-        return round((active - no_mask) / active, 4) if active > 0 else None
+    st.write(f"##### 変更内容（{len(changes)} 件）")
+    st.dataframe(changes[['date'] + DISPLAY_COLUMNS].rename(columns=COLUMN_LABELS), hide_index=True, use_container_width=True)
 
-    new_values['pachinko_mask_rate'] = calc_rate(new_values['pachinko_active'], new_values['pachinko_no_mask'])
-    new_values['slot_mask_rate'] = calc_rate(new_values['slot_active'], new_values['slot_no_mask'])
-    new_values['total_mask_rate'] = calc_rate(new_values['total_active'], new_values['total_no_mask'])
+    if changes[['pachinko_no_mask', 'slot_no_mask']].isna().any().any():
+        st.error("未着用の人数は空欄にできません。")
+        return
 
     if st.button("更新する"):
-        current_data = pd.read_sql_query("SELECT * FROM mask_status WHERE id = ?", conn, params=(row['id'],)).iloc[0].to_dict()
-
-        # 値の違いをチェック
-        has_changes = False
-        for k in new_values:
-            if isinstance(new_values[k], float) and isinstance(current_data[k], float):
-                if not np.isclose(new_values[k], current_data[k], rtol=1e-04):
-                    has_changes = True
-                    break
-            elif new_values[k] != current_data[k]:
-                has_changes = True
-                break
-
-        if has_changes:
-            cursor = conn.execute(
-                """
-                UPDATE mask_status
-                SET
-                    pachinko_no_mask = ?, slot_no_mask = ?, total_no_mask = ?,
-                    pachinko_active = ?, slot_active = ?, total_active = ?,
-                    pachinko_mask_rate = ?, slot_mask_rate = ?, total_mask_rate = ?
-                WHERE id = ?
-                """,
-                (
-                    new_values['pachinko_no_mask'], new_values['slot_no_mask'], new_values['total_no_mask'],
-                    new_values['pachinko_active'], new_values['slot_active'], new_values['total_active'],
-                    new_values['pachinko_mask_rate'], new_values['slot_mask_rate'], new_values['total_mask_rate'],
-                    row['id']
-                )
+        versions = original.set_index('id')['row_version']
+        rows = [
+            {'id': int(row_id), 'row_version': int(versions[row_id]), **{c: _to_db_value(row[c]) for c in EDIT_COLUMNS}}
+            for row_id, row in changes.iterrows()
+        ]
+        try:
+            count = db.update_mask_status_rows(rows, EDIT_COLUMNS)
+            st.session_state["edit_message"] = ("success", f"{count} 件のデータを更新しました。")
+        except db.ConflictError as e:
+            dates = original.set_index('id')['date'].reindex(e.ids).dropna().tolist()
+            st.session_state["edit_message"] = (
+                "error",
+                f"他の更新と競合したため保存しませんでした（{', '.join(dates)}）。最新のデータを読み込み直したので、もう一度修正してください。"
             )
-            conn.commit()
-            st.success("データを更新しました。")
-            st.write(f"更新対象ID: {row['id']}")
-            st.write(f"変更件数: {cursor.rowcount} 件")
-        else:
-            st.info("変更が検出されなかったため、更新は行われませんでした。")
-
-    conn.close()
+        # 編集内容を破棄して最新のデータを読み込み直す
+        st.session_state["edit_nonce"] = nonce + 1
+        st.rerun()
@@ -0,0 +1,89 @@
+import csv
+import io
+import analytics
+import db
+
+# ===== 絞り込んだ明細のダウンロード（CSV / Excel） =====
+# db.iter_mask_status のチャンクを1行ずつ書き出す（全件を DataFrame にしない）。
+# ただし書き出したファイルはメモリ上に置いて bytes で返すので、ファイル1つ分のメモリは必要になる
+
+# (db.iter_mask_status の列, 見出し)。見出しと着用率の表示は「マスク着用率一覧（年月指定）」の表に合わせる
+COLUMNS = [
+    ('id', 'ID'),
+    ('store_name', '店舗名'),
+    ('area', '地区'),
+    ('type', '種別'),
+    ('date', '日付'),
+    ('pachinko_no_mask', '未着用P'),
+    ('slot_no_mask', '未着用S'),
+    ('total_no_mask', '未着用計'),
+    ('pachinko_active', '稼働P'),
+    ('slot_active', '稼働S'),
+    ('total_active', '稼働計'),
+    ('pachinko_mask_rate', '着用率P'),
+    ('slot_mask_rate', '着用率S'),
+    ('total_mask_rate', '着用率計'),
+]
+RATE_COLUMNS = {'pachinko_mask_rate', 'slot_mask_rate', 'total_mask_rate'}
+
+def _format_row(row):
+    return [
+        analytics.format_rate(row[column]) if column in RATE_COLUMNS else row[column]
+        for column, _ in COLUMNS
+    ]
+
+def _rows(chunks):
+    for chunk in chunks:
+        for row in chunk:
+            yield _format_row(row)
+
+def write_csv(chunks, file):
+    # Excel で開いても文字化けしないよう BOM 付き UTF-8 で書く
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    writer = csv.writer(text)
+    writer.writerow([header for _, header in COLUMNS])
+    for row in _rows(chunks):
+        writer.writerow(['' if value is None else value for value in row])
+    text.flush()
+    text.detach()
+
+def write_xlsx(chunks, file):
+    # 書き込み専用モードのブックは行をそのまま一時ファイルへ書き出すため、組み立て中に全行をメモリに持たない
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("マスク着用データ")
+    sheet.append([header for _, header in COLUMNS])
+    for row in _rows(chunks):
+        sheet.append(row)
+    workbook.save(file)
+
+FORMATS = {
+    'CSV': ('csv', 'text/csv', write_csv),
+    'Excel': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', write_xlsx),
+}
+
+def export(format_name, **filters):
+    # filters は db.iter_mask_status の絞り込み条件。ファイルの中身を bytes で返す
+    _, _, write = FORMATS[format_name]
+    file = io.BytesIO()
+    write(db.iter_mask_status(**filters), file)
+    return file.getvalue()
+
+# ===== ダウンロードボタン =====
+def render_download(key, file_stem, **filters):
+    # ファイルはボタンが押されたときに作る（再実行のたびには書き出さない）
+    import streamlit as st
+
+    col_format, col_button = st.columns([1, 3])
+    with col_format:
+        format_name = st.radio("形式", list(FORMATS), horizontal=True, key=f"{key}_format")
+    extension, mime, _ = FORMATS[format_name]
+    with col_button:
+        st.download_button(
+            f"{format_name} でダウンロード",
+            data=lambda: export(format_name, **filters),
+            file_name=f"{file_stem}.{extension}",
+            mime=mime,
+            key=f"{key}_download",
+        )
@@ -0,0 +1,144 @@
+import pandas as pd
+import db
+from migrate import DATE_PATTERN, normalize_store_name
+
+# ===== 取り込み設定 =====
+CHUNK_SIZE = 5000
+PREVIEW_ROWS = 20
+MAX_REJECTS = 1000
+
+MASK_REQUIRED_INT_COLUMNS = ['store_id', 'year', 'month', 'pachinko_no_mask', 'slot_no_mask']
+MASK_OPTIONAL_INT_COLUMNS = ['pachinko_active', 'slot_active']
+STORE_COLUMNS = ['store_name', 'area', 'type']
+# store_id の代わりに store_name（別名も可）で店舗を指定できる。合計・着用率の列があっても使わない
+MASK_COLUMNS_BY_NAME = ['store_name'] + db.MASK_STATUS_COLUMNS[1:]
+
+def has_mask_columns(columns):
+    columns = set(columns)
+    return set(db.MASK_STATUS_COLUMNS).issubset(columns) or set(MASK_COLUMNS_BY_NAME).issubset(columns)
+
+# ===== ファイル確認・プレビュー =====
+def read_columns(uploaded_file):
+    columns = list(pd.read_csv(uploaded_file, nrows=0).columns)
+    uploaded_file.seek(0)
+    return columns
+
+def preview(uploaded_file, nrows=PREVIEW_ROWS):
+    df = pd.read_csv(uploaded_file, nrows=nrows, dtype=str)
+    uploaded_file.seek(0)
+    return df
+
+def _read_chunks(uploaded_file, chunk_size):
+    for chunk in pd.read_csv(uploaded_file, dtype=str, chunksize=chunk_size):
+        yield chunk.apply(lambda col: col.str.strip())
+
+# ===== チャンク単位の検証（ベクトル演算） =====
+def _flag(reasons, mask, reason):
+    # 行ごとに最初に見つかった理由だけを残す
+    reasons[mask & (reasons == '')] = reason
+
+def _to_int(series, reasons, column, required):
+    num = pd.to_numeric(series, errors='coerce').astype('float64')
+    invalid = num.isna() | (num % 1 != 0) | (num < 0)
+    if not required:
+        invalid &= series.notna()
+    _flag(reasons, invalid, f"{column} が0以上の整数ではありません")
+    return num.where(~invalid).astype('Int64')
+
+def _to_python_rows(frame):
+    frame = frame.astype(object)
+    frame = frame.where(frame.notna(), None)
+    return list(frame.itertuples(index=False, name=None))
+
+def _collect_rejects(reasons):
+    bad = reasons[reasons != '']
+    # ヘッダーが1行目のため、データ行はインデックス + 2 行目
+    return list(zip((bad.index + 2).tolist(), bad.tolist()))
+
+def _resolve_store_names(names, store_index):
+    return names.map(lambda name: store_index.get(normalize_store_name(name)) if isinstance(name, str) else None)
+
+def validate_mask_chunk(chunk, store_ids, store_index=None):
+    reasons = pd.Series('', index=chunk.index, dtype=object)
+    values = {}
+
+    if 'store_id' not in chunk.columns:
+        store_id = _resolve_store_names(chunk['store_name'], store_index)
+        _flag(reasons, store_id.isna(), "store_name が登録されていません")
+        chunk = chunk.assign(store_id=store_id.astype(object))
+
+    for column in MASK_REQUIRED_INT_COLUMNS:
+        values[column] = _to_int(chunk[column], reasons, column, required=True)
+    for column in MASK_OPTIONAL_INT_COLUMNS:
+        values[column] = _to_int(chunk[column], reasons, column, required=False)
+
+    _flag(reasons, ~values['store_id'].isin(store_ids).fillna(False).astype(bool), "store_id が登録されていません")
+    _flag(reasons, ~values['month'].between(1, 12).fillna(False).astype(bool), "month が1〜12ではありません")
+
+    parts = chunk['date'].str.extract(DATE_PATTERN).apply(pd.to_numeric)
+    dates = pd.to_datetime(
+        pd.DataFrame({'year': parts[0], 'month': parts[1], 'day': parts[2]}),
+        errors='coerce'
+    )
+    _flag(reasons, dates.isna(), "date の形式が不正です")
+    values['date'] = dates.dt.strftime('%Y-%m-%d')
+
+    valid = reasons == ''
+    frame = pd.DataFrame(values)[db.MASK_STATUS_COLUMNS][valid]
+    return _to_python_rows(frame), _collect_rejects(reasons)
+
+def validate_store_chunk(chunk, known_keys):
+    # known_keys: 登録済みの店舗名・別名（正規化済み）。受け付けた店舗名を追加していく
+    reasons = pd.Series('', index=chunk.index, dtype=object)
+    for column in STORE_COLUMNS:
+        _flag(reasons, chunk[column].fillna('') == '', f"{column} が空です")
+
+    keys = chunk['store_name'].fillna('').map(normalize_store_name)
+    _flag(reasons, keys.isin(known_keys), "店舗名（または別名）が登録済みです")
+    _flag(reasons, keys.duplicated(), "ファイル内で店舗名が重複しています")
+
+    valid = reasons == ''
+    known_keys.update(keys[valid])
+    return _to_python_rows(chunk[STORE_COLUMNS][valid]), _collect_rejects(reasons)
+
+# ===== 取り込み（全チャンクを1トランザクションで登録） =====
+def _new_report():
+    return {'inserted': 0, 'rejected': 0, 'rejects': []}
+
+def _record_rejects(report, rejects):
+    report['rejected'] += len(rejects)
+    room = MAX_REJECTS - len(report['rejects'])
+    if room > 0:
+        report['rejects'].extend(rejects[:room])
+
+def rejects_frame(report):
+    return pd.DataFrame(report['rejects'], columns=['行番号', '理由'])
+
+def ingest_mask_status(uploaded_file, chunk_size=CHUNK_SIZE):
+    store_ids = db.get_store_ids()
+    store_index = db.get_store_alias_index()
+    report = _new_report()
+
+    def _chunks():
+        for chunk in _read_chunks(uploaded_file, chunk_size):
+            rows, rejects = validate_mask_chunk(chunk, store_ids, store_index)
+            _record_rejects(report, rejects)
+            if rows:
+                yield rows
+
+    report['inserted'] = db.insert_mask_status_chunks(_chunks())
+    return report
+
+def ingest_stores(uploaded_file, chunk_size=CHUNK_SIZE):
+    known_keys = set(db.get_store_alias_index())
+    report = _new_report()
+
+    def _chunks():
+        for chunk in _read_chunks(uploaded_file, chunk_size):
+            rows, rejects = validate_store_chunk(chunk, known_keys)
+            _record_rejects(report, rejects)
+            if rows:
+                yield rows
+
+    report['inserted'] = db.insert_store_chunks(_chunks())
+    return report
@@ -0,0 +1,74 @@
+import re
+from email import message_from_bytes, policy
+from migrate import normalize_store_name
+
+# ===== 稼働データメールの解析（Streamlit 非依存） =====
+# 例: "P  計  123  ..." / "S  計  45  ..."（計 の直後の値を稼働人数とする）
+_TOTAL_RE = re.compile(r'^([PS])\s+計(?:\s+(\S+))?')
+
+def read_uploaded_text(uploaded_file):
+    # .eml はプレーンテキスト本文を、.txt はそのまま文字列として読み込む
+    data = uploaded_file.getvalue()
+    if uploaded_file.name.lower().endswith('.eml'):
+        message = message_from_bytes(data, policy=policy.default)
+        body = message.get_body(preferencelist=('plain',))
+        return body.get_content() if body is not None else ''
+    for encoding in ('utf-8-sig', 'cp932'):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode('utf-8', errors='replace')
+
+def parse_report(text, store_index):
+    # store_index: 正規化した店舗名・別名 → 店舗ID（db.get_store_alias_index）
+    # 戻り値: records = (店舗ID, 稼働P, 稼働S) のリスト、unparsable = (行番号, 行, 理由) のリスト
+    records = []
+    unparsable = []
+    current_store = None
+    current_name = None
+    p_val = None
+    s_val = None
+
+    for line_no, line in enumerate(text.splitlines(), start=1):
+        line = line.strip()
+        if not line:
+            continue
+
+        store_id = store_index.get(normalize_store_name(line))
+        if store_id is not None:
+            current_store = store_id
+            current_name = line
+            p_val = None
+            s_val = None
+            continue
+
+        match = _TOTAL_RE.match(line)
+        if not match:
+            continue
+
+        if current_store is None:
+            # 登録されていない店舗名の後の値を、直前の店舗の値として扱わない
+            unparsable.append((line_no, line, "店舗名が登録されていないため、どの店舗の値か分かりません"))
+            continue
+
+        kind, value = match.groups()
+        try:
+            number = int(value)
+        except (TypeError, ValueError):
+            number = None
+            unparsable.append((line_no, line, f"{kind} 計 の値を数値として読み取れません"))
+
+        if kind == 'P':
+            p_val = number
+            continue
+
+        s_val = number
+        if p_val is not None and s_val is not None:
+            records.append((current_store, p_val, s_val))
+        elif s_val is not None:
+            unparsable.append((line_no, line, f"{current_name} の P 計 の値がありません"))
+        # S 計 で店舗のブロックは終わる（次の店舗名が見つかるまで値を受け付けない）
+        current_store = None
+
+    return {'records': records, 'unparsable': unparsable}
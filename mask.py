@@ -1,41 +1,66 @@
 import streamlit as st
-import sqlite3
-import pandas as pd
 from datetime import datetime
-
-# ===== DB接続 =====
-DB_FILE = 'mask.db'
-
-def get_connection():
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def get_store_all():
-    conn = get_connection()
-    df = pd.read_sql_query('SELECT * FROM store ORDER BY id', conn)
-    conn.close()
-    return df
-
-def get_mask_status_all():
-    conn = get_connection()
-    df = pd.read_sql_query('''
-        SELECT ms.id, s.store_name, ms.date, ms.year, ms.month,
-               ms.pachinko_no_mask, ms.slot_no_mask, ms.total_no_mask,
-               ms.pachinko_active, ms.slot_active, ms.total_active,
-               ms.pachinko_mask_rate, ms.slot_mask_rate, ms.total_mask_rate
-        FROM mask_status ms
-        JOIN store s ON ms.store_id = s.id
-        ORDER BY ms.date DESC, ms.store_id
-    ''', conn)
-    conn.close()
-    return df
+import db
+import export
+import ingest
+import profiling
+
+PAGE_SIZE = 50
+
+@st.fragment
+def registered_data_grid(stores):
+    # 絞り込み・ページ送りではフラグメントだけが再実行されるため、ここでも再実行として計測する
+    with profiling.rerun("登録済みデータ一覧"):
+        _registered_data_grid(stores)
+
+def _registered_data_grid(stores):
+    # 表示中のページ分だけをDBから取得する（フィルタはSQL側で適用）
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        store_filter = st.selectbox("店舗で絞り込み", ["すべて"] + list(stores['store_name']), key="grid_store")
+    with col2:
+        area_filter = st.selectbox("地区で絞り込み", ["すべて"] + db.get_areas(), key="grid_area")
+    with col3:
+        date_range = st.date_input("期間で絞り込み", value=(), key="grid_dates")
+
+    store_id = None
+    if store_filter != "すべて":
+        store_id = int(stores.loc[stores['store_name'] == store_filter, 'id'].iloc[0])
+    area = area_filter if area_filter != "すべて" else None
+    date_from = date_range[0].strftime("%Y-%m-%d") if len(date_range) >= 1 else None
+    date_to = date_range[-1].strftime("%Y-%m-%d") if len(date_range) == 2 else None
+
+    # フィルタが変わったら先頭ページに戻す
+    filters = (store_id, area, date_from, date_to)
+    if st.session_state.get("grid_filters") != filters:
+        st.session_state["grid_filters"] = filters
+        st.session_state["grid_cursors"] = [None]
+    cursors = st.session_state["grid_cursors"]
+
+    df_page, has_next = db.get_mask_status_page(*filters, after=cursors[-1], limit=PAGE_SIZE)
+    st.dataframe(df_page, use_container_width=True, hide_index=True)
+
+    next_cursor = (df_page.iloc[-1]['date'], int(df_page.iloc[-1]['id'])) if has_next else None
+
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    with col_prev:
+        st.button("前へ", disabled=len(cursors) == 1, key="grid_prev", on_click=cursors.pop)
+    with col_page:
+        st.caption(f"{len(cursors)} ページ目（{PAGE_SIZE} 件ずつ表示）")
+    with col_next:
+        st.button("次へ", disabled=not has_next, key="grid_next", on_click=cursors.append, args=(next_cursor,))
+
+    # 絞り込み条件に合う全件（アーカイブ済みの明細を含む）をダウンロードする
+    export.render_download(
+        "grid_export", "mask_status",
+        store_id=store_id, area=area, date_from=date_from, date_to=date_to
+    )
 
 def mask_page():
     st.title("非着用者＋稼働人数入力")
 
     # ----- 入力フォーム -----
-    stores = get_store_all()
+    stores = db.get_store_all()
     store_name_to_id = {row['store_name']: row['id'] for _, row in stores.iterrows()}
     store_selection = st.selectbox("店舗を選択", list(store_name_to_id.keys()))
     selected_date = st.date_input("日付を選択", datetime.today())
@@ -46,29 +71,13 @@ def mask_page():
     slot_active = st.number_input("稼働人数（スロット）", min_value=0, step=1, value=0)
 
     if st.button("データ登録"):
-        year = selected_date.year
-        month = selected_date.month
-        total_no_mask = pachinko_no_mask + slot_no_mask
-
-        pachinko_mask_rate = round((pachinko_active - pachinko_no_mask) / pachinko_active * 100) if pachinko_active else None
-        slot_mask_rate = round((slot_active - slot_no_mask) / slot_active * 100) if slot_active else None
-        total_active = pachinko_active + slot_active if pachinko_active and slot_active else None
-        total_mask_rate = round((total_active - total_no_mask) / total_active * 100) if total_active else None
-
-        conn = get_connection()
-        conn.execute('''
-            INSERT INTO mask_status (
-                store_id, date, year, month,
-                pachinko_no_mask, slot_no_mask, total_no_mask,
-                pachinko_active, slot_active, total_active,
-                pachinko_mask_rate, slot_mask_rate, total_mask_rate
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (store_name_to_id[store_selection], selected_date.strftime("%Y/%m/%d"), year, month,
-              pachinko_no_mask, slot_no_mask, total_no_mask,
-              pachinko_active or None, slot_active or None, total_active,
-              pachinko_mask_rate, slot_mask_rate, total_mask_rate))
-        conn.commit()
-        conn.close()
+        # 合計と着用率は DB 側で人数から計算される
+        db.insert_mask_status((
+            store_name_to_id[store_selection], selected_date.strftime("%Y-%m-%d"),
+            selected_date.year, selected_date.month,
+            pachinko_no_mask, slot_no_mask,
+            pachinko_active or None, slot_active or None
+        ))
         st.success("データを登録しました！")
 
     # ----- CSVインポート -----
@@ -77,56 +86,32 @@ def mask_page():
 
     if uploaded_file is not None:
         try:
-            df_upload = pd.read_csv(uploaded_file)
-
-            required_columns = [
-                'store_id', 'date', 'year', 'month',
-                'pachinko_no_mask', 'slot_no_mask', 'total_no_mask',
-                'pachinko_active', 'slot_active', 'total_active',
-                'pachinko_mask_rate', 'slot_mask_rate', 'total_mask_rate'
-            ]
-
-            if set(required_columns).issubset(df_upload.columns):
-                st.dataframe(df_upload, use_container_width=True)
+            if ingest.has_mask_columns(ingest.read_columns(uploaded_file)):
+                st.caption(f"先頭 {ingest.PREVIEW_ROWS} 行のプレビュー")
+                st.dataframe(ingest.preview(uploaded_file), use_container_width=True)
 
                 if st.button("アップロードデータをDBに登録"):
-                    conn = get_connection()
-                    for _, row in df_upload.iterrows():
-                        conn.execute('''
-                            INSERT INTO mask_status (
-                                store_id, date, year, month,
-                                pachinko_no_mask, slot_no_mask, total_no_mask,
-                                pachinko_active, slot_active, total_active,
-                                pachinko_mask_rate, slot_mask_rate, total_mask_rate
-                            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        ''', (
-                            row['store_id'], row['date'], row['year'], row['month'],
-                            row['pachinko_no_mask'], row['slot_no_mask'], row['total_no_mask'],
-                            row['pachinko_active'], row['slot_active'], row['total_active'],
-                            row['pachinko_mask_rate'], row['slot_mask_rate'], row['total_mask_rate']
-                        ))
-                    conn.commit()
-                    conn.close()
-                    st.success("CSVデータをDBに登録しました！")
+                    report = ingest.ingest_mask_status(uploaded_file)
+                    st.success(f"CSVデータをDBに登録しました！（{report['inserted']} 件）")
+                    if report['rejected']:
+                        st.warning(f"{report['rejected']} 行は登録できませんでした。")
+                        st.dataframe(ingest.rejects_frame(report), use_container_width=True, hide_index=True)
             else:
-                st.error("CSVに必要なカラムがすべて含まれていません。")
+                st.error("CSVに必要なカラムがすべて含まれていません。（店舗は store_id または store_name で指定）")
 
         except Exception as e:
             st.error(f"エラーが発生しました: {e}")
 
     # ----- 登録済みデータ一覧表示 -----
     st.subheader("登録済みデータ一覧")
-    df_mask = get_mask_status_all()
-    st.dataframe(df_mask, use_container_width=True)
+    registered_data_grid(stores)
 
     # ----- 削除機能 -----
     st.subheader("登録データの削除")
     delete_id = st.number_input("削除したいデータのIDを入力", min_value=1, step=1)
 
     if st.button("このIDのデータを削除"):
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("DELETE FROM mask_status WHERE id = ?", (delete_id,))
-        conn.commit()
-        conn.close()
-        st.success(f"ID {delete_id} のデータを削除しました。")
+        if db.delete_mask_status(delete_id):
+            st.success(f"ID {delete_id} のデータを削除しました。")
+        else:
+            st.warning(f"ID {delete_id} のデータは見つかりませんでした。")
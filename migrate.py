@@ -0,0 +1,391 @@
+import argparse
+import re
+import sqlite3
+import unicodedata
+import profiling
+import rollup
+
+# ===== データベースファイルのパス =====
+DB_FILE = 'mask.db'
+
+# ===== 日付の正規化（YYYY-MM-DD） =====
+DATE_PATTERN = r'^\s*(\d{4})[/\-.年](\d{1,2})[/\-.月](\d{1,2})'
+_DATE_RE = re.compile(DATE_PATTERN)
+
+def normalize_date(value):
+    match = _DATE_RE.match(str(value))
+    if not match:
+        raise ValueError(f"日付の形式が不正です: {value}")
+    year, month, day = (int(v) for v in match.groups())
+    return f"{year:04d}-{month:02d}-{day:02d}"
+
+# ===== 店舗名の正規化（別名の照合キー） =====
+def normalize_store_name(value):
+    # 全角・半角の揺れを NFKC でそろえ、前後の空白を除いて連続する空白を1つにする
+    return ' '.join(unicodedata.normalize('NFKC', str(value)).split())
+
+# 稼働データメールでの表記 → 登録店舗名（以前 active.py に直接書いていた対応表）
+INITIAL_STORE_ALIASES = {
+    #延岡地区
+    "西の丸センター": "センター",
+    "西の丸延岡店": "延岡店",
+    "西の丸古川店": "古川店",
+    "サンクス恵比須店": "恵比須",
+    "ファミリー三愛延岡店": "ファミリー三愛延岡店",
+    "ダイナム宮崎延岡店 ゆったり館": "ダイナム宮崎延岡店 ゆったり館",
+    "CORE21南延岡店": "CORE21南延岡店",
+    "シリウス延岡店": "シリウス延岡店",
+    "オーパス延岡店": "オーパス延岡店",
+    "Super D’station39延岡店": "Super D’station39延岡店",
+
+    # 東児湯地区
+    "西の丸川南店": "川南",
+
+    # 日向地区
+    "西の丸門川店": "門川",
+    "西の丸エーワン": "エーワン",
+    "CORE21日向店": "CORE21日向店",
+    "まるみつ日向店": "まるみつ日向店",
+    "ダイナム宮崎日向店 ゆったり館": "ダイナム宮崎日向店",
+    "ダイナム宮崎日向財光寺店 ゆったり館": "ダイナム宮崎日向財光寺店",
+    "シルバーバック日向店": "シルバーバック日向店",
+    "Super D’station39日向店": "Super D’station39日向店"
+}
+
+# ===== マイグレーション定義 =====
+def _create_base_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS store (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            store_name TEXT NOT NULL,
+            area TEXT NOT NULL,
+            type TEXT NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS mask_status (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            store_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            year INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            pachinko_no_mask INTEGER NOT NULL,
+            slot_no_mask INTEGER NOT NULL,
+            total_no_mask INTEGER NOT NULL,
+            pachinko_active INTEGER,
+            slot_active INTEGER,
+            total_active INTEGER,
+            pachinko_mask_rate REAL,
+            slot_mask_rate REAL,
+            total_mask_rate REAL,
+            FOREIGN KEY (store_id) REFERENCES store (id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS comments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            year INTEGER,
+            month INTEGER,
+            comment TEXT,
+            created_at TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS config (
+            key TEXT PRIMARY KEY,
+            value REAL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)')
+
+def _normalize_dates(conn):
+    # '2024/1/5' などの表記を並べ替え可能な '2024-01-05' に統一する
+    rows = conn.execute('SELECT id, date FROM mask_status').fetchall()
+    updates = []
+    for row_id, value in rows:
+        iso = normalize_date(value)
+        if iso != value:
+            updates.append((iso, row_id))
+    conn.executemany('UPDATE mask_status SET date = ? WHERE id = ?', updates)
+
+def _create_indexes(conn):
+    # 一覧表示（日付降順）
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_mask_status_date ON mask_status (date DESC, store_id)')
+    # 店舗別履歴（データ修正ページ）
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_mask_status_store_date ON mask_status (store_id, date)')
+    # 年月指定の一覧表
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_mask_status_year_month ON mask_status (year, month)')
+    # 稼働データ未登録の最新行（稼働データ登録ページ）
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_mask_status_unfilled ON mask_status (store_id, date)
+        WHERE pachinko_active IS NULL OR pachinko_active = 0
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_store_name ON store (store_name)')
+    conn.execute('ANALYZE')
+
+def _create_rollup(conn):
+    rollup.create_table(conn)
+    rollup.rebuild(conn)
+
+def _create_keyset_index(conn):
+    # 登録済みデータ一覧のキーセットページング (date, id)
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_mask_status_date_id ON mask_status (date, id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_store_area ON store (area)')
+    conn.execute('ANALYZE')
+
+def _add_row_version(conn):
+    # データ修正の楽観的排他制御用（更新のたびに +1）
+    conn.execute('ALTER TABLE mask_status ADD COLUMN row_version INTEGER NOT NULL DEFAULT 0')
+
+def _create_comment_search(conn):
+    # コメント一覧（新しい順・年月指定）のインデックス
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_comments_created_at ON comments (created_at DESC, id DESC)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_comments_year_month ON comments (year, month, created_at)')
+    # 本文の全文検索（日本語は単語の区切りがないため trigram で部分一致させる）
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS comments_fts
+        USING fts5(comment, content='comments', content_rowid='id', tokenize='trigram')
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS comments_fts_insert AFTER INSERT ON comments BEGIN
+            INSERT INTO comments_fts (rowid, comment) VALUES (new.id, new.comment);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS comments_fts_delete AFTER DELETE ON comments BEGIN
+            INSERT INTO comments_fts (comments_fts, rowid, comment) VALUES ('delete', old.id, old.comment);
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS comments_fts_update AFTER UPDATE OF comment ON comments BEGIN
+            INSERT INTO comments_fts (comments_fts, rowid, comment) VALUES ('delete', old.id, old.comment);
+            INSERT INTO comments_fts (rowid, comment) VALUES (new.id, new.comment);
+        END
+    ''')
+    conn.execute("INSERT INTO comments_fts (comments_fts) VALUES ('rebuild')")
+
+def _create_store_alias(conn):
+    # 正規化した別名 → 店舗ID。店舗名そのものと稼働データメールでの表記を登録する
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS store_alias (
+            alias_key TEXT PRIMARY KEY,
+            alias TEXT NOT NULL,
+            store_id INTEGER NOT NULL,
+            FOREIGN KEY (store_id) REFERENCES store (id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_store_alias_store ON store_alias (store_id)')
+
+    stores = {}
+    for store_id, store_name in conn.execute('SELECT id, store_name FROM store ORDER BY id'):
+        stores.setdefault(normalize_store_name(store_name), store_id)
+    rows = [(key, key, store_id) for key, store_id in stores.items()]
+    for alias, store_name in INITIAL_STORE_ALIASES.items():
+        store_id = stores.get(normalize_store_name(store_name))
+        if store_id is not None:
+            rows.append((normalize_store_name(alias), alias, store_id))
+    conn.executemany('INSERT OR IGNORE INTO store_alias (alias_key, alias, store_id) VALUES (?, ?, ?)', rows)
+
+# mask_status の定義（v9 以降。地区別シャードのファイルも同じ定義で作る）
+MASK_STATUS_TABLE_SQL = '''
+    CREATE TABLE {name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        store_id INTEGER NOT NULL,
+        date TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        month INTEGER NOT NULL,
+        pachinko_no_mask INTEGER NOT NULL,
+        slot_no_mask INTEGER NOT NULL,
+        pachinko_active INTEGER,
+        slot_active INTEGER,
+        row_version INTEGER NOT NULL DEFAULT 0,
+        total_no_mask INTEGER GENERATED ALWAYS AS (pachinko_no_mask + slot_no_mask) VIRTUAL,
+        total_active INTEGER GENERATED ALWAYS AS (pachinko_active + slot_active) VIRTUAL,
+        pachinko_mask_rate REAL GENERATED ALWAYS AS (
+            CASE WHEN pachinko_active > 0 THEN (pachinko_active - pachinko_no_mask) * 1.0 / pachinko_active END
+        ) VIRTUAL,
+        slot_mask_rate REAL GENERATED ALWAYS AS (
+            CASE WHEN slot_active > 0 THEN (slot_active - slot_no_mask) * 1.0 / slot_active END
+        ) VIRTUAL,
+        total_mask_rate REAL GENERATED ALWAYS AS (
+            CASE WHEN pachinko_active + slot_active > 0
+                 THEN (pachinko_active + slot_active - pachinko_no_mask - slot_no_mask) * 1.0 / (pachinko_active + slot_active)
+            END
+        ) VIRTUAL{foreign_key}
+    )
+'''
+MASK_STATUS_FOREIGN_KEY = ',\n        FOREIGN KEY (store_id) REFERENCES store (id)'
+
+# mask_status のインデックス（v3・v5 で作成したもの）
+MASK_STATUS_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_mask_status_date ON mask_status (date DESC, store_id)',
+    'CREATE INDEX IF NOT EXISTS idx_mask_status_store_date ON mask_status (store_id, date)',
+    'CREATE INDEX IF NOT EXISTS idx_mask_status_year_month ON mask_status (year, month)',
+    '''
+        CREATE INDEX IF NOT EXISTS idx_mask_status_unfilled ON mask_status (store_id, date)
+        WHERE pachinko_active IS NULL OR pachinko_active = 0
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_mask_status_date_id ON mask_status (date, id)',
+]
+
+def _derive_totals_and_rates(conn):
+    # 合計と着用率（0〜1）は人数から計算する生成列にする（テーブルを作り直してデータを移す）
+    conn.execute(MASK_STATUS_TABLE_SQL.format(name='mask_status_new', foreign_key=MASK_STATUS_FOREIGN_KEY))
+    conn.execute('''
+        INSERT INTO mask_status_new (
+            id, store_id, date, year, month,
+            pachinko_no_mask, slot_no_mask, pachinko_active, slot_active, row_version
+        )
+        SELECT id, store_id, date, year, month,
+               pachinko_no_mask, slot_no_mask, pachinko_active, slot_active, row_version
+        FROM mask_status
+    ''')
+    conn.execute('DROP TABLE mask_status')
+    conn.execute('ALTER TABLE mask_status_new RENAME TO mask_status')
+    _create_indexes(conn)
+    _create_keyset_index(conn)
+    rollup.rebuild(conn)
+
+def _create_shard_registry(conn):
+    # 地区別シャード（MASK_SHARDED=1）の地区 → シャード番号。番号からファイル名と行IDの範囲が決まる
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS mask_shard (
+            area TEXT PRIMARY KEY,
+            shard_no INTEGER NOT NULL UNIQUE
+        )
+    ''')
+
+def _create_quarterly_summary(conn):
+    # アーカイブ（archive.py）で移した四半期の店舗別集計。date はその四半期の最後の調査日、
+    # measured_no_mask は稼働人数が登録済みの行だけの未着用人数
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS mask_quarterly (
+            store_id INTEGER NOT NULL,
+            year INTEGER NOT NULL,
+            quarter INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            total_no_mask INTEGER NOT NULL,
+            total_active INTEGER NOT NULL,
+            measured_no_mask INTEGER NOT NULL,
+            row_count INTEGER NOT NULL,
+            PRIMARY KEY (store_id, year, quarter),
+            FOREIGN KEY (store_id) REFERENCES store (id)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_mask_quarterly_year ON mask_quarterly (year, quarter)')
+
+MIGRATIONS = [
+    (1, "基本テーブル作成", _create_base_tables),
+    (2, "日付をISO形式に統一", _normalize_dates),
+    (3, "インデックス作成", _create_indexes),
+    (4, "地区別集計テーブル作成", _create_rollup),
+    (5, "ページング用インデックス作成", _create_keyset_index),
+    (6, "行バージョン列追加", _add_row_version),
+    (7, "コメント検索用インデックス・全文検索作成", _create_comment_search),
+    (8, "店舗別名テーブル作成", _create_store_alias),
+    (9, "合計・着用率を生成列に変更", _derive_totals_and_rates),
+    (10, "地区別シャード管理テーブル作成", _create_shard_registry),
+    (11, "アーカイブ済み四半期の集計テーブル作成", _create_quarterly_summary),
+]
+
+# ===== 実行 =====
+def get_version(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def upgrade(db_file=DB_FILE, verbose=False):
+    conn = sqlite3.connect(db_file, isolation_level=None, factory=profiling.connection_factory())
+    try:
+        current = get_version(conn)
+        for version, name, fn in MIGRATIONS:
+            if version <= current:
+                continue
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                fn(conn)
+                conn.execute(f'PRAGMA user_version = {version}')
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            current = version
+            if verbose:
+                print(f"v{version}: {name} を適用しました。")
+        return current
+    finally:
+        conn.close()
+
+# ===== クエリプラン確認 =====
+# 稼働データ未登録の行を店舗ごとに新しい順で、店舗ごとに ? 件まで取得する（メール取り込み）
+# placeholders は店舗IDの数だけの ?
+UNFILLED_ROWS_SQL = '''
+    SELECT store_id, id, date, rn
+    FROM (
+        SELECT store_id, id, date,
+               ROW_NUMBER() OVER (PARTITION BY store_id ORDER BY date DESC, id DESC) AS rn
+        FROM mask_status
+        WHERE store_id IN ({placeholders})
+          AND (pachinko_active IS NULL OR pachinko_active = 0)
+    )
+    WHERE rn <= ?
+    ORDER BY store_id, rn
+'''
+
+QUERY_SHAPES = {
+    "一覧表示（日付降順）": ('''
+        SELECT ms.id, s.store_name, ms.date, ms.total_mask_rate
+        FROM mask_status ms
+        JOIN store s ON ms.store_id = s.id
+        ORDER BY ms.date DESC, ms.store_id
+    ''', ()),
+    "店舗別履歴（データ修正）": ('''
+        SELECT id, date, pachinko_no_mask, slot_no_mask, pachinko_active, slot_active, row_version
+        FROM mask_status
+        WHERE store_id = ? AND date >= ? AND date <= ?
+        ORDER BY date DESC, id DESC
+    ''', (1, '2024-01-01', '2024-12-31')),
+    "年月指定": ('SELECT * FROM mask_status WHERE year = ? AND month = ?', (2024, 1)),
+    "稼働データ未登録の最新行": (UNFILLED_ROWS_SQL.format(placeholders='?, ?'), (1, 2, 1)),
+}
+
+def explain(db_file=DB_FILE):
+    conn = sqlite3.connect(db_file, factory=profiling.connection_factory())
+    try:
+        plans = {}
+        for name, (sql, params) in QUERY_SHAPES.items():
+            try:
+                rows = conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+                plans[name] = [row[3] for row in rows]
+            except sqlite3.OperationalError as e:
+                plans[name] = [f"（実行できません: {e}）"]
+        return plans
+    finally:
+        conn.close()
+
+def _print_plans(plans):
+    for name, steps in plans.items():
+        print(f"[{name}]")
+        for step in steps:
+            print(f"  {step}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="mask.db のスキーマを最新版に更新します。")
+    parser.add_argument('--db', default=DB_FILE, help="対象のデータベースファイル")
+    parser.add_argument('--explain', action='store_true', help="更新前後のクエリプランを表示する")
+    args = parser.parse_args()
+
+    if args.explain:
+        print("===== 更新前のクエリプラン =====")
+        _print_plans(explain(args.db))
+
+    version = upgrade(args.db, verbose=True)
+    print(f"スキーマバージョン: v{version}")
+
+    if args.explain:
+        print("===== 更新後のクエリプラン =====")
+        _print_plans(explain(args.db))
@@ -0,0 +1,69 @@
+from collections import namedtuple
+import db
+
+# ===== ダッシュボードの各表示 → SQL（Streamlit 非依存） =====
+# 表示ごとの選択内容を、インデックスを使うパラメータ付きSQLに変換する。
+# 取得するのは表示に必要な行と列だけ（履歴全体は読み込まない）
+# route: シャード構成での読み込み先（{'area': ...} / {'store_id': ...}。None なら全シャード）
+# order: 全シャードの結果を連結した後の並べ替え [(列, 昇順か)]
+Plan = namedtuple('Plan', ['name', 'sql', 'params', 'route', 'order'], defaults=[None, None])
+
+YEAR_MONTH_TABLE_COLUMNS = [
+    'store_name',
+    'pachinko_no_mask', 'slot_no_mask', 'total_no_mask',
+    'pachinko_active', 'slot_active', 'total_active',
+    'pachinko_mask_rate', 'slot_mask_rate', 'total_mask_rate'
+]
+
+def year_month_table(year, month):
+    # idx_mask_status_year_month
+    return Plan('year_month_table', '''
+        SELECT s.store_name, ms.date,
+               ms.pachinko_no_mask, ms.slot_no_mask, ms.total_no_mask,
+               ms.pachinko_active, ms.slot_active, ms.total_active,
+               ms.pachinko_mask_rate, ms.slot_mask_rate, ms.total_mask_rate
+        FROM mask_status ms
+        JOIN store s ON ms.store_id = s.id
+        WHERE ms.year = ? AND ms.month = ?
+        ORDER BY ms.date DESC, ms.store_id
+    ''', (int(year), int(month)), order=[('date', False)])
+
+# アーカイブ済みの四半期（mask_quarterly）と本体の明細を合わせた店舗ごとの履歴
+_STORE_SERIES_SQL = '''
+    SELECT s.area, s.store_name, q.date, q.total_no_mask, q.total_active
+    FROM mask_quarterly q
+    JOIN store s ON q.store_id = s.id
+    WHERE {where_summary}
+    UNION ALL
+    SELECT s.area, s.store_name, ms.date,
+           SUM(ms.total_no_mask) AS total_no_mask, SUM(ms.total_active) AS total_active
+    FROM mask_status ms
+    JOIN store s ON ms.store_id = s.id
+    WHERE {where_detail}
+    GROUP BY ms.store_id, ms.date
+    ORDER BY date
+'''
+
+def area_store_series(area):
+    # 地区の店舗（idx_store_area）→ 店舗ごとの履歴（idx_mask_status_store_date）
+    sql = _STORE_SERIES_SQL.format(where_summary='s.area = ?', where_detail='s.area = ?')
+    return Plan('area_store_series', sql, (area, area), route={'area': area})
+
+def store_series(store_id):
+    # idx_mask_status_store_date
+    sql = _STORE_SERIES_SQL.format(where_summary='q.store_id = ?', where_detail='ms.store_id = ?')
+    return Plan('store_series', sql, (int(store_id), int(store_id)), route={'store_id': int(store_id)})
+
+# ===== 実行 =====
+def run(plan):
+    # シャード構成では route のシャードだけ、なければ全シャードに並列で実行する
+    return db.read_mask_status(plan.sql, plan.params, **(plan.route or {}), order=plan.order)
+
+def cached(plan, transform=None):
+    # 同じ表示・同じ選択の結果は更新カウンタが変わるまで再利用する
+    loader = (lambda: transform(run(plan))) if transform else (lambda: run(plan))
+    return db.cached(('planner', plan.name, plan.params), loader)
+
+def explain(plan):
+    with db.connection() as conn:
+        return [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + plan.sql, plan.params)]
@@ -0,0 +1,212 @@
+import json
+import logging
+import os
+import threading
+import time
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+# ===== 計測（MASK_PROFILE=1 で有効。Streamlit 非依存） =====
+# 有効時は db のコネクションが ProfilingConnection になり、再実行ごとに
+# SQL（件数・取得行数・時間）とページ・グラフ作成の時間を集計する
+ENABLED = os.environ.get('MASK_PROFILE') == '1'
+LOG_FILE = os.environ.get('MASK_PROFILE_LOG', 'profile.log')
+LOG_MAX_BYTES = 1024 * 1024
+LOG_BACKUP_COUNT = 3
+SLOW_QUERIES = 5
+
+# 集計中の再実行（Streamlit はセッションごとに別スレッドでスクリプトを実行する）
+_local = threading.local()
+
+def _current():
+    return getattr(_local, 'rerun', None)
+
+def current():
+    return _current()
+
+@contextmanager
+def attached(stats):
+    # 別スレッド（db の書き込み専用スレッド）での処理を呼び出し元の再実行として集計する
+    previous = _current()
+    _local.rerun = stats
+    try:
+        yield
+    finally:
+        _local.rerun = previous
+
+# ===== SQL の計測 =====
+class ProfilingCursor(sqlite3.Cursor):
+    _entry = None
+
+    def _start(self, sql):
+        rerun = _current()
+        if rerun is None:
+            self._entry = None
+            return
+        self._entry = {'sql': ' '.join(sql.split()), 'rows': 0, 'seconds': 0.0}
+        rerun['queries'].append(self._entry)
+
+    def _timed(self, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            if self._entry is not None:
+                self._entry['seconds'] += time.perf_counter() - start
+
+    def execute(self, sql, parameters=()):
+        self._start(sql)
+        return self._timed(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._start(sql)
+        return self._timed(super().executemany, sql, seq_of_parameters)
+
+    def _fetched(self, rows):
+        if self._entry is not None:
+            self._entry['rows'] += rows
+        return rows
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        self._fetched(0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(super().fetchmany, self.arraysize if size is None else size)
+        self._fetched(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self._fetched(len(rows))
+        return rows
+
+    def __next__(self):
+        row = self._timed(super().__next__)
+        self._fetched(1)
+        return row
+
+class ProfilingConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # トリガーや BEGIN/COMMIT を含め、実際に実行された文の数を数える
+        self.set_trace_callback(_trace)
+
+    def cursor(self, factory=ProfilingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+def _trace(statement):
+    rerun = _current()
+    if rerun is not None:
+        rerun['statements'] += 1
+
+def connection_factory():
+    return ProfilingConnection if ENABLED else sqlite3.Connection
+
+# ===== ページ・グラフの計測 =====
+@contextmanager
+def timer(kind, name):
+    rerun = _current()
+    if rerun is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        rerun['timers'].append({'kind': kind, 'name': name, 'seconds': time.perf_counter() - start})
+
+@contextmanager
+def rerun(page):
+    # 1回の再実行を集計し、終了時にログへ追記する
+    # 集計中の再実行の中で呼ばれた場合（ページ全体の再実行で描画されるフラグメント）は、その内訳の1つとして計る
+    if not ENABLED:
+        yield None
+        return
+    outer = _current()
+    if outer is not None:
+        with timer('fragment', page):
+            yield outer
+        return
+    stats = {'page': page, 'queries': [], 'timers': [], 'statements': 0}
+    _local.rerun = stats
+    start = time.perf_counter()
+    try:
+        with timer('page', page):
+            yield stats
+    finally:
+        stats['seconds'] = time.perf_counter() - start
+        _local.rerun = None
+        _log(summary(stats))
+
+def summary(stats):
+    queries = stats['queries']
+    slow = sorted(queries, key=lambda q: q['seconds'], reverse=True)[:SLOW_QUERIES]
+    return {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'page': stats['page'],
+        'seconds': round(stats.get('seconds', 0.0), 4),
+        'query_count': len(queries),
+        'statement_count': stats['statements'],
+        'rows': sum(q['rows'] for q in queries),
+        'query_seconds': round(sum(q['seconds'] for q in queries), 4),
+        'timers': [{**t, 'seconds': round(t['seconds'], 4)} for t in stats['timers']],
+        'slow_queries': [{**q, 'seconds': round(q['seconds'], 4)} for q in slow],
+    }
+
+def query_table(stats):
+    # 同じ SQL をまとめる（件数が多いものは N+1 の候補）
+    grouped = {}
+    for q in stats['queries']:
+        entry = grouped.setdefault(q['sql'], {'sql': q['sql'], 'count': 0, 'rows': 0, 'ms': 0.0})
+        entry['count'] += 1
+        entry['rows'] += q['rows']
+        entry['ms'] += q['seconds'] * 1000
+    return sorted(grouped.values(), key=lambda e: e['ms'], reverse=True)
+
+# ===== ローテーションするログファイル =====
+_logger = None
+_logger_lock = threading.Lock()
+
+def _log(record):
+    global _logger
+    with _logger_lock:
+        if _logger is None:
+            logger = logging.getLogger('mask.profile')
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            handler = RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8')
+            logger.addHandler(handler)
+            _logger = logger
+    _logger.info(json.dumps(record, ensure_ascii=False))
+
+# ===== サイドバーのデバッグ表示 =====
+def render_panel(stats):
+    import streamlit as st
+
+    if stats is None:
+        return
+    record = summary(stats)
+    with st.sidebar.expander("デバッグ（計測）"):
+        st.write(f"再実行 {record['seconds'] * 1000:.1f} ms")
+        st.write(
+            f"SQL {record['query_count']} 件（文 {record['statement_count']} 件） / "
+            f"{record['rows']} 行 / {record['query_seconds'] * 1000:.1f} ms"
+        )
+        st.dataframe(
+            [{'種別': t['kind'], '名前': t['name'], 'ms': round(t['seconds'] * 1000, 1)} for t in record['timers']],
+            hide_index=True
+        )
+        st.dataframe(
+            [{'SQL': q['sql'], '回数': q['count'], '行数': q['rows'], 'ms': round(q['ms'], 1)} for q in query_table(stats)],
+            hide_index=True
+        )
@@ -0,0 +1,155 @@
+import argparse
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import analytics
+import db
+
+# ===== 四半期レポートの一括作成（ブラウザ不要） =====
+# 例: python report.py --from 2024Q1 --to 2025Q4 --out reports --by area
+_QUARTER_RE = re.compile(r'^(\d{4})Q([1-4])$')
+
+def parse_quarter(text):
+    match = _QUARTER_RE.match(text.strip().upper())
+    if not match:
+        raise argparse.ArgumentTypeError(f"四半期は 2024Q1 の形式で指定してください: {text}")
+    return int(match.group(1)), int(match.group(2))
+
+def quarter_range(start, end):
+    quarters = []
+    year, quarter = start
+    while (year, quarter) <= end:
+        quarters.append((year, quarter))
+        year, quarter = (year + 1, 1) if quarter == 4 else (year, quarter + 1)
+    return quarters
+
+def quarter_label(year, quarter):
+    return f"{year}Q{quarter}"
+
+def quarter_dates(year, quarter):
+    first_month = (quarter - 1) * 3 + 1
+    return f"{year:04d}-{first_month:02d}-01", f"{year:04d}-{first_month + 2:02d}-31"
+
+# ===== ワーカー（プロセスごとに DB へ接続する） =====
+# 親プロセスのプール済みコネクションを fork で子に持ち込まないよう、ワーカーは spawn で起動する
+def _init_worker(db_file):
+    db.DB_FILE = db_file
+
+def _with_rate(df):
+    df = df[df['total_active'] > 0].copy()
+    df['mask_rate'] = analytics.mask_rate(df['total_no_mask'], df['total_active'])
+    return df
+
+def compute(quarters, area=None):
+    # 指定した四半期（と地区）の店舗別・地区別の人数合計を返す
+    stores = []
+    areas = []
+    for year, quarter in quarters:
+        date_from, date_to = quarter_dates(year, quarter)
+        df = db.get_mask_status_counts(date_from, date_to, area)
+        if df.empty:
+            continue
+        totals = analytics.store_totals(df)
+        totals.insert(0, 'quarter', quarter_label(year, quarter))
+        stores.append(totals)
+        areas.append(
+            totals.groupby(['quarter', 'area', 'date'], sort=True)[analytics.COUNT_COLUMNS].sum().reset_index()
+        )
+    if not stores:
+        return None, None
+    return pd.concat(stores, ignore_index=True), pd.concat(areas, ignore_index=True)
+
+# ===== 出力 =====
+STORE_COLUMNS = {
+    'quarter': '四半期', 'area': '地区', 'store_name': '店舗名', 'date': '日付',
+    'total_no_mask': '未着用計', 'total_active': '稼働計', 'mask_rate': '着用率（％）',
+}
+
+def _display(df):
+    df = df.rename(columns=STORE_COLUMNS)
+    df['着用率（％）'] = df['着用率（％）'].round(1)
+    return df
+
+def write_reports(store_totals, area_totals, out_dir, formats):
+    os.makedirs(out_dir, exist_ok=True)
+    overall = area_totals.groupby(['quarter', 'date'], sort=True)[analytics.COUNT_COLUMNS].sum().reset_index()
+    tables = {
+        'store': _with_rate(store_totals.sort_values(['quarter', 'area', 'store_name', 'date'])),
+        'area': _with_rate(area_totals.sort_values(['quarter', 'area', 'date'])),
+        'overall': _with_rate(overall),
+    }
+    titles = {'overall': "全地区", 'area': "地区別", 'store': "店舗別"}
+
+    written = []
+    for label in sorted(overall['quarter'].unique()):
+        per_quarter = {name: _display(df[df['quarter'] == label]) for name, df in tables.items()}
+        if 'csv' in formats:
+            for name, df in per_quarter.items():
+                path = os.path.join(out_dir, f"{label}_{name}.csv")
+                df.to_csv(path, index=False, encoding='utf-8-sig')
+                written.append(path)
+        if 'html' in formats:
+            path = os.path.join(out_dir, f"{label}.html")
+            sections = [
+                f"<h2>{titles[name]}</h2>\n" + per_quarter[name].to_html(index=False, na_rep='')
+                for name in ('overall', 'area', 'store')
+            ]
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(
+                    f"<!DOCTYPE html>\n<html lang=\"ja\"><head><meta charset=\"utf-8\">"
+                    f"<title>マスク着用率レポート {label}</title></head><body>\n"
+                    f"<h1>マスク着用率レポート {label}</h1>\n" + "\n".join(sections) + "\n</body></html>\n"
+                )
+            written.append(path)
+    return written
+
+def run(args):
+    quarters = quarter_range(args.start, args.end)
+    db_file = os.path.abspath(args.db)
+    db.DB_FILE = db_file
+
+    # 地区ごと、または四半期ごとに分割してプロセスプールで集計する
+    if args.by == 'area':
+        tasks = [(quarters, area) for area in db.get_areas()]
+    else:
+        tasks = [([quarter], None) for quarter in quarters]
+
+    with ProcessPoolExecutor(
+        max_workers=args.workers, mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker, initargs=(db_file,)
+    ) as pool:
+        futures = [pool.submit(compute, *task) for task in tasks]
+        results = [future.result() for future in futures]
+
+    store_parts = [stores for stores, _ in results if stores is not None]
+    area_parts = [areas for _, areas in results if areas is not None]
+    if not store_parts:
+        return []
+    return write_reports(
+        pd.concat(store_parts, ignore_index=True),
+        pd.concat(area_parts, ignore_index=True),
+        args.out, args.format
+    )
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="四半期ごとのマスク着用率レポート（全地区・地区別・店舗別）を作成します。")
+    parser.add_argument('--from', dest='start', type=parse_quarter, required=True, help="開始四半期（例: 2024Q1）")
+    parser.add_argument('--to', dest='end', type=parse_quarter, required=True, help="終了四半期（例: 2025Q4）")
+    parser.add_argument('--db', default=db.DB_FILE, help="DBファイル")
+    parser.add_argument('--out', default='reports', help="出力先ディレクトリ")
+    parser.add_argument('--by', choices=['area', 'quarter'], default='area', help="並列処理の分割単位")
+    parser.add_argument('--workers', type=int, default=None, help="プロセス数（省略時はCPU数）")
+    parser.add_argument('--format', nargs='+', choices=['csv', 'html'], default=['csv', 'html'], help="出力形式")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    written = run(args)
+    if written:
+        print(f"{len(written)} ファイルを {args.out} に出力しました（{time.perf_counter() - start:.1f} 秒）。")
+    else:
+        print("指定した期間のデータがありません。")
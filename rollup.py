@@ -0,0 +1,68 @@
+import argparse
+import sqlite3
+
+# ===== データベースファイルのパス =====
+DB_FILE = 'mask.db'
+
+# ===== 地区・種別・日付ごとの集計テーブル =====
+_ROLLUP_SELECT = '''
+    SELECT s.area, s.type, ms.date,
+           COALESCE(SUM(ms.total_no_mask), 0),
+           COALESCE(SUM(ms.total_active), 0),
+           COUNT(*)
+    FROM mask_status ms
+    JOIN store s ON ms.store_id = s.id
+    {where}
+    GROUP BY s.area, s.type, ms.date
+'''
+
+def create_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS mask_rollup (
+            area TEXT NOT NULL,
+            type TEXT NOT NULL,
+            date TEXT NOT NULL,
+            total_no_mask_sum INTEGER NOT NULL,
+            total_active_sum INTEGER NOT NULL,
+            row_count INTEGER NOT NULL,
+            PRIMARY KEY (area, type, date)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_mask_rollup_date ON mask_rollup (date)')
+
+def rebuild(conn):
+    # 全件再集計（呼び出し側のトランザクション内で実行する）
+    conn.execute('DELETE FROM mask_rollup')
+    conn.execute('INSERT INTO mask_rollup ' + _ROLLUP_SELECT.format(where=''))
+
+def refresh_dates(conn, dates):
+    # 指定日付の集計行だけを作り直す（書き込みと同じトランザクション内で呼び出す）
+    # db は rollup を読み込むため、db の MAX_PARAMS はここで読み込む
+    from db import MAX_PARAMS
+
+    dates = sorted({d for d in dates if d is not None})
+    for start in range(0, len(dates), MAX_PARAMS):
+        chunk = dates[start:start + MAX_PARAMS]
+        placeholders = ', '.join('?' for _ in chunk)
+        conn.execute(f'DELETE FROM mask_rollup WHERE date IN ({placeholders})', chunk)
+        conn.execute(
+            'INSERT INTO mask_rollup ' + _ROLLUP_SELECT.format(where=f'WHERE ms.date IN ({placeholders})'),
+            chunk
+        )
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="集計テーブル mask_rollup を全件再作成します。")
+    parser.add_argument('--db', default=DB_FILE, help="対象のデータベースファイル")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        create_table(conn)
+        rebuild(conn)
+        conn.execute('UPDATE data_version SET version = version + 1 WHERE id = 1')
+        conn.execute('COMMIT')
+        count = conn.execute('SELECT COUNT(*) FROM mask_rollup').fetchone()[0]
+    finally:
+        conn.close()
+    print(f"mask_rollup を再作成しました（{count} 行）。")
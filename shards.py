@@ -0,0 +1,155 @@
+import argparse
+import os
+import sqlite3
+import migrate
+import profiling
+import rollup
+
+# ===== 地区別シャード（MASK_SHARDED=1 で有効。Streamlit 非依存） =====
+# 地区ごとの mask_status を別ファイルに置き、ある地区の取り込みが他の地区の書き込みを待たせないようにする。
+# 店舗・別名・コメント・設定と 地区 → シャード番号（mask_shard）は本体のDBに残し、
+# シャードのコネクションには本体を ATTACH して store を参照する
+ENABLED = os.environ.get('MASK_SHARDED') == '1'
+ATTACH_NAME = 'main_db'
+SCHEMA_VERSION = 1
+# 行IDはシャード番号 × ID_SPAN から振る（IDだけで行のあるシャードが分かる）
+ID_SPAN = 10 ** 12
+
+def shard_dir(db_file):
+    return os.path.splitext(db_file)[0] + '_shards'
+
+def shard_file(db_file, shard_no):
+    return os.path.join(shard_dir(db_file), f'area_{shard_no:03d}.db')
+
+def shard_of_id(row_id):
+    return int(row_id) // ID_SPAN
+
+def assign(conn, area):
+    # 地区のシャード番号を返す（未登録なら新しい番号を振る）。本体の書き込みトランザクション内で呼び出す
+    row = conn.execute('SELECT shard_no FROM mask_shard WHERE area = ?', (area,)).fetchone()
+    if row:
+        return row[0]
+    shard_no = conn.execute('SELECT COALESCE(MAX(shard_no), 0) + 1 FROM mask_shard').fetchone()[0]
+    conn.execute('INSERT INTO mask_shard (area, shard_no) VALUES (?, ?)', (area, shard_no))
+    return shard_no
+
+def ensure(db_file, shard_no):
+    # シャードのファイルと mask_status・集計テーブル・更新カウンタを作る（作成済みなら何もしない）
+    os.makedirs(shard_dir(db_file), exist_ok=True)
+    conn = sqlite3.connect(shard_file(db_file, shard_no), isolation_level=None, factory=profiling.connection_factory())
+    try:
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if migrate.get_version(conn) < SCHEMA_VERSION:
+                conn.execute(migrate.MASK_STATUS_TABLE_SQL.format(name='mask_status', foreign_key=''))
+                for sql in migrate.MASK_STATUS_INDEXES:
+                    conn.execute(sql)
+                conn.execute(
+                    "INSERT INTO sqlite_sequence (name, seq) VALUES ('mask_status', ?)",
+                    (shard_no * ID_SPAN,)
+                )
+                rollup.create_table(conn)
+                conn.execute('CREATE TABLE data_version (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL)')
+                conn.execute('INSERT INTO data_version (id, version) VALUES (1, 0)')
+                conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    finally:
+        conn.close()
+
+# ===== 既存データの移行 =====
+def _copy_area(db_file, area, shard_no):
+    ensure(db_file, shard_no)
+    conn = sqlite3.connect(shard_file(db_file, shard_no), isolation_level=None, factory=profiling.connection_factory())
+    try:
+        conn.execute(f'ATTACH DATABASE ? AS {ATTACH_NAME}', (db_file,))
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # 行IDはシャードの範囲にずらす（再実行しても重複しない）
+            count = conn.execute(f'''
+                INSERT OR IGNORE INTO mask_status (
+                    id, store_id, date, year, month,
+                    pachinko_no_mask, slot_no_mask, pachinko_active, slot_active, row_version
+                )
+                SELECT ms.id + ?, ms.store_id, ms.date, ms.year, ms.month,
+                       ms.pachinko_no_mask, ms.slot_no_mask, ms.pachinko_active, ms.slot_active, ms.row_version
+                FROM {ATTACH_NAME}.mask_status ms
+                JOIN {ATTACH_NAME}.store s ON s.id = ms.store_id
+                WHERE s.area = ?
+            ''', (shard_no * ID_SPAN, area)).rowcount
+            rollup.rebuild(conn)
+            conn.execute('UPDATE data_version SET version = version + 1 WHERE id = 1')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    finally:
+        conn.close()
+    return count
+
+def split(db_file):
+    # 本体の mask_status を地区ごとのシャードへ移す（MASK_SHARDED=1 で起動する前に1回実行する）
+    migrate.upgrade(db_file)
+    conn = sqlite3.connect(db_file, isolation_level=None, factory=profiling.connection_factory())
+    try:
+        max_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM mask_status').fetchone()[0]
+        if max_id >= ID_SPAN:
+            raise ValueError(f"行IDがシャードの範囲を超えています: {max_id}")
+        # アーカイブ済みの四半期集計は本体にしかないため、シャードの結果と二重に数えないよう分けない
+        if conn.execute('SELECT EXISTS (SELECT 1 FROM mask_quarterly)').fetchone()[0]:
+            raise ValueError("アーカイブ済みの四半期があるDBは地区別シャードに分けられません。")
+        conn.execute('BEGIN IMMEDIATE')
+        areas = [row[0] for row in conn.execute('SELECT DISTINCT area FROM store ORDER BY area')]
+        shard_nos = {area: assign(conn, area) for area in areas}
+        conn.execute('UPDATE data_version SET version = version + 1 WHERE id = 1')
+        conn.execute('COMMIT')
+    finally:
+        conn.close()
+
+    moved = {area: _copy_area(db_file, area, shard_no) for area, shard_no in shard_nos.items()}
+
+    # すべてのシャードへのコピーが終わってから本体の行を消す（途中で止まっても再実行できる）
+    conn = sqlite3.connect(db_file, isolation_level=None, factory=profiling.connection_factory())
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('DELETE FROM mask_status WHERE store_id IN (SELECT id FROM store)')
+        rollup.rebuild(conn)
+        conn.execute('UPDATE data_version SET version = version + 1 WHERE id = 1')
+        conn.execute('COMMIT')
+    finally:
+        conn.close()
+    return moved
+
+def status(db_file):
+    conn = sqlite3.connect(db_file, factory=profiling.connection_factory())
+    try:
+        shard_nos = conn.execute('SELECT area, shard_no FROM mask_shard ORDER BY shard_no').fetchall()
+    finally:
+        conn.close()
+    result = []
+    for area, shard_no in shard_nos:
+        path = shard_file(db_file, shard_no)
+        count = None
+        if os.path.exists(path):
+            shard = sqlite3.connect(path, factory=profiling.connection_factory())
+            try:
+                count = shard.execute('SELECT COUNT(*) FROM mask_status').fetchone()[0]
+            finally:
+                shard.close()
+        result.append((area, shard_no, path, count))
+    return result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="地区別シャード（MASK_SHARDED=1）の状態確認と既存データの移行を行います。")
+    parser.add_argument('--db', default=migrate.DB_FILE, help="本体のデータベースファイル")
+    parser.add_argument('--split', action='store_true', help="本体の mask_status を地区ごとのシャードへ移す")
+    args = parser.parse_args()
+
+    if args.split:
+        for area, count in split(args.db).items():
+            print(f"{area}: {count} 行を移しました。")
+    for area, shard_no, path, count in status(args.db):
+        print(f"[{shard_no}] {area}: {path}（{'未作成' if count is None else f'{count} 行'}）")
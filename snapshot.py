@@ -0,0 +1,202 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+import db
+
+# ===== mask_status の列指向スナップショット（MASK_SNAPSHOT=1 で有効。Streamlit 非依存） =====
+# 書き込みのコミット後に別スレッドで mask_status と store を結合した全行を列ごとの .npy に書き出し、
+# ダッシュボードは np.load(mmap_mode='r') で開いて絞り込む（SQLite に問い合わせず、行ごとの Python オブジェクトも作らない）。
+# 店舗名・地区・種別は meta.json の一覧への番号で持つ。
+# 書き出しは別ディレクトリに作ってから current.json を置き換えて切り替える。
+# 書き出した時点の更新カウンタが今の値と違う間（書き出しが追いついていない間）は SQLite から読む
+ENABLED = os.environ.get('MASK_SNAPSHOT') == '1'
+# 切り替え直後に古い版を読み込み中のセッションがあるため、直前の版は消さずに残す
+KEEP_VERSIONS = 2
+
+_EXPORT_SQL = '''
+    SELECT ms.id, ms.store_id, s.store_name, s.area, s.type, ms.date, ms.year, ms.month,
+           ms.pachinko_no_mask, ms.slot_no_mask, ms.total_no_mask,
+           ms.pachinko_active, ms.slot_active, ms.total_active,
+           ms.pachinko_mask_rate, ms.slot_mask_rate, ms.total_mask_rate
+    FROM mask_status ms
+    JOIN store s ON ms.store_id = s.id
+    ORDER BY ms.date DESC, ms.store_id
+'''
+_EXPORT_ORDER = [('date', False), ('store_id', True)]
+
+# 番号で持つ列（meta.json に一覧を書く）
+DICTIONARY_COLUMNS = ['store_name', 'area', 'type']
+# 数値の列。人数は稼働人数が未登録（NULL）の行があるため NaN の入る float64 で持つ
+NUMERIC_COLUMNS = {
+    'id': 'int64',
+    'store_id': 'int64',
+    'year': 'int16',
+    'month': 'int8',
+    'pachinko_no_mask': 'float64',
+    'slot_no_mask': 'float64',
+    'total_no_mask': 'float64',
+    'pachinko_active': 'float64',
+    'slot_active': 'float64',
+    'total_active': 'float64',
+    'pachinko_mask_rate': 'float64',
+    'slot_mask_rate': 'float64',
+    'total_mask_rate': 'float64',
+}
+COUNT_COLUMNS = [column for column in NUMERIC_COLUMNS if column.endswith(('_no_mask', '_active'))]
+
+_logger = logging.getLogger('mask.snapshot')
+
+def snapshot_dir(db_file):
+    return os.path.splitext(db_file)[0] + '_snapshot'
+
+# ===== 書き出し =====
+def build():
+    # 今のDBの内容を書き出して切り替え、書き出した更新カウンタを返す。
+    # 更新カウンタは読み込みの前に取る（読み込み中に書き込みがあれば古い番号のままになり、次の書き出しまで SQLite から読む）
+    version = db.get_data_version()
+    df = db.read_mask_status(_EXPORT_SQL, order=_EXPORT_ORDER)
+
+    root = snapshot_dir(db.DB_FILE)
+    os.makedirs(root, exist_ok=True)
+    name = f'v{version}'
+    if not os.path.exists(os.path.join(root, name)):
+        work = tempfile.mkdtemp(prefix='.build-', dir=root)
+        try:
+            _write_columns(work, df, version)
+            os.rename(work, os.path.join(root, name))
+        except BaseException:
+            shutil.rmtree(work, ignore_errors=True)
+            raise
+
+    current = os.path.join(root, 'current.json')
+    with open(current + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'dir': name, 'data_version': version}, f)
+    os.replace(current + '.tmp', current)
+    _remove_old(root)
+    return version
+
+def _write_columns(path, df, version):
+    meta = {'data_version': version, 'rows': len(df)}
+    for column in DICTIONARY_COLUMNS:
+        codes, uniques = pd.factorize(df[column])
+        np.save(os.path.join(path, f'{column}.npy'), codes.astype('int32'))
+        meta[column] = [str(value) for value in uniques]
+    np.save(os.path.join(path, 'date.npy'), pd.to_datetime(df['date']).to_numpy(dtype='datetime64[D]'))
+    for column, dtype in NUMERIC_COLUMNS.items():
+        np.save(os.path.join(path, f'{column}.npy'), pd.to_numeric(df[column]).to_numpy(dtype=dtype, na_value=np.nan))
+    with open(os.path.join(path, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+def _remove_old(root):
+    # 新しい版を KEEP_VERSIONS 個だけ残し、途中で止まった書き出しの作業ディレクトリも消す
+    versions = sorted(
+        (int(name[1:]) for name in os.listdir(root) if name.startswith('v') and name[1:].isdigit()),
+        reverse=True
+    )
+    stale = [f'v{version}' for version in versions[KEEP_VERSIONS:]]
+    stale += [name for name in os.listdir(root) if name.startswith('.build-')]
+    for name in stale:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+# ===== 書き出し専用スレッド（コミットのたびに起こす） =====
+_wanted = threading.Event()
+_thread = None
+_thread_lock = threading.Lock()
+
+def request():
+    # 書き出しを要求する（書き出し中に要求されたら、終わった後にもう一度書き出す）
+    _wanted.set()
+
+def start():
+    # db の書き込みのコミット後に書き出すようにする（何度呼んでもよい）
+    global _thread
+    with _thread_lock:
+        if _thread is None:
+            db.add_commit_hook(request)
+            _thread = threading.Thread(target=_export_loop, name='snapshot-export', daemon=True)
+            _thread.start()
+
+def _export_loop():
+    while True:
+        _wanted.wait()
+        _wanted.clear()
+        try:
+            build()
+        except Exception:
+            # 書き出せなくても読み込みは SQLite に戻るだけなので、記録して次の要求を待つ
+            _logger.exception("スナップショットの書き出しに失敗しました")
+
+# ===== 読み込み =====
+_loaded = None
+_load_lock = threading.Lock()
+
+def _load(version):
+    # 更新カウンタが version の版を開く（列はメモリマップ）。まだ書き出されていなければ None
+    global _loaded
+    with _load_lock:
+        if _loaded is not None and _loaded[0] == version:
+            return _loaded
+        root = snapshot_dir(db.DB_FILE)
+        try:
+            with open(os.path.join(root, 'current.json'), encoding='utf-8') as f:
+                current = json.load(f)
+            if current['data_version'] != version:
+                return None
+            path = os.path.join(root, current['dir'])
+            with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+            columns = {
+                column: np.load(os.path.join(path, f'{column}.npy'), mmap_mode='r')
+                for column in DICTIONARY_COLUMNS + ['date'] + list(NUMERIC_COLUMNS)
+            }
+        except (OSError, ValueError):
+            # 未作成、または開いている間に古い版として消された
+            return None
+        _loaded = (version, columns, meta)
+        return _loaded
+
+def _frame(columns, meta, rows, names):
+    # rows 行目だけを取り出して DataFrame にする（SQLite から読んだ場合と同じく、NULL がなければ人数は整数）
+    data = {}
+    for name in names:
+        values = columns[name][rows]
+        if name in DICTIONARY_COLUMNS:
+            values = np.array(meta[name], dtype=object)[values]
+        elif name == 'date':
+            values = np.datetime_as_string(values, unit='D').astype(object)
+        elif name in COUNT_COLUMNS and not np.isnan(values).any():
+            values = values.astype('int64')
+        data[name] = values
+    return pd.DataFrame(data)
+
+YEAR_MONTH_TABLE_COLUMNS = [
+    'store_name', 'date',
+    'pachinko_no_mask', 'slot_no_mask', 'total_no_mask',
+    'pachinko_active', 'slot_active', 'total_active',
+    'pachinko_mask_rate', 'slot_mask_rate', 'total_mask_rate'
+]
+
+def year_month_table(year, month):
+    # planner.year_month_table と同じ列・同じ順の結果。スナップショットが古い・未作成なら None（SQLite から読むこと）
+    loaded = _load(db.get_data_version())
+    if loaded is None:
+        request()
+        return None
+    _, columns, meta = loaded
+    rows = np.flatnonzero((columns['year'] == int(year)) & (columns['month'] == int(month)))
+    return _frame(columns, meta, rows, YEAR_MONTH_TABLE_COLUMNS)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="mask_status の列指向スナップショットを書き出します。")
+    parser.add_argument('--db', default=db.DB_FILE, help="対象のデータベースファイル")
+    args = parser.parse_args()
+
+    db.DB_FILE = args.db
+    version = build()
+    print(f"{snapshot_dir(args.db)} に書き出しました（更新カウンタ {version}）。")
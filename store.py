@@ -1,20 +1,6 @@
 import streamlit as st
-import sqlite3
-import pandas as pd
-
-# ===== DB接続 =====
-DB_FILE = 'mask.db'
-
-def get_connection():
-    conn = sqlite3.connect(DB_FILE)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def get_store_all():
-    conn = get_connection()
-    df = pd.read_sql_query('SELECT * FROM store ORDER BY id', conn)
-    conn.close()
-    return df
+import db
+import ingest
 
 def store_page():
     st.title("店舗登録")
@@ -26,38 +12,70 @@ def store_page():
 
     if st.button("店舗登録"):
         if store_name:
-            conn = get_connection()
-            conn.execute('INSERT INTO store (store_name, area, type) VALUES (?, ?, ?)', (store_name, area, store_type))
-            conn.commit()
-            conn.close()
-            st.success("店舗を登録しました！")
+            try:
+                db.insert_store(store_name, area, store_type)
+                st.success("店舗を登録しました！")
+            except ValueError as e:
+                st.error(str(e))
         else:
             st.error("店舗名を入力してください。")
 
     # 登録済み店舗一覧表示
     st.subheader("登録済み店舗一覧")
-    df = get_store_all()
+    df = db.get_store_all()
     st.dataframe(df, use_container_width=True)
 
+    # メール・CSVでの店舗名の表記（別名）
+    st.subheader("店舗名の別名登録（稼働データメール・CSV取り込み用）")
+    stores = db.get_store_names()
+    store_names = dict(zip(stores['id'], stores['store_name']))
+    col1, col2 = st.columns(2)
+    with col1:
+        alias = st.text_input("メール・CSVでの表記", key="alias_text")
+    with col2:
+        alias_store_id = st.selectbox("対応する店舗", list(store_names), format_func=store_names.get, key="alias_store")
+
+    if st.button("別名を登録"):
+        if alias.strip() and alias_store_id is not None:
+            try:
+                db.set_store_alias(alias, int(alias_store_id))
+                st.success(f"「{alias.strip()}」を {store_names[alias_store_id]} の別名として登録しました。")
+            except ValueError as e:
+                st.error(str(e))
+        else:
+            st.error("表記と店舗を入力してください。")
+
+    with st.expander("登録済みの別名"):
+        aliases = db.get_store_aliases()
+        aliases.columns = ['表記', '店舗名', '地区', '店舗ID']
+        st.dataframe(aliases, use_container_width=True, hide_index=True)
+
+        # 店舗名そのものの登録は削除できない（削除しようとするとエラーを表示する）
+        delete_alias = st.selectbox("削除する別名", list(aliases['表記']), key="alias_delete")
+        if st.button("別名を削除") and delete_alias is not None:
+            try:
+                db.delete_store_alias(delete_alias)
+                st.success(f"別名「{delete_alias}」を削除しました。")
+            except ValueError as e:
+                st.error(str(e))
+
     # CSVインポート
     st.subheader("CSVインポート（store_id, store_name, area, type）")
     uploaded_file = st.file_uploader("CSVファイルを選択", type="csv", key="store_csv")
 
     if uploaded_file is not None:
         try:
-            df_csv = pd.read_csv(uploaded_file)
-            required_cols = {'store_name', 'area', 'type'}
-            if required_cols.issubset(df_csv.columns):
-                st.dataframe(df_csv)
+            required_cols = set(ingest.STORE_COLUMNS)
+            if required_cols.issubset(ingest.read_columns(uploaded_file)):
+                st.caption(f"先頭 {ingest.PREVIEW_ROWS} 行のプレビュー")
+                st.dataframe(ingest.preview(uploaded_file))
 
                 if st.button("CSVの内容をDBに登録"):
-                    conn = get_connection()
-                    for _, row in df_csv.iterrows():
-                        conn.execute('INSERT INTO store (store_name, area, type) VALUES (?, ?, ?)', 
-                                     (row['store_name'], row['area'], row['type']))
-                    conn.commit()
-                    conn.close()
-                    st.success("CSVデータを登録しました。")
+                    report = ingest.ingest_stores(uploaded_file)
+                    st.success(f"CSVデータを登録しました。（{report['inserted']} 件）")
+                    if report['rejected']:
+                        st.warning(f"{report['rejected']} 行は登録できませんでした。")
+                        st.dataframe(ingest.rejects_frame(report), use_container_width=True, hide_index=True)
             else:
                 st.error("CSVには store_name, area, type の3列が必要です。")
         except Exception as e:
@@ -68,9 +86,5 @@ def store_page():
     delete_id = st.number_input("削除したい店舗のIDを入力", min_value=1, step=1)
 
     if st.button("このIDの店舗を削除"):
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("DELETE FROM store WHERE id = ?", (delete_id,))
-        conn.commit()
-        conn.close()
+        db.delete_store(delete_id)
         st.success(f"ID {delete_id} の店舗を削除しました。")
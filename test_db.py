@@ -0,0 +1,25 @@
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def _run_sharded(db_file, code):
+    # db.SHARDED は読み込み時に MASK_SHARDED で決まるので、別プロセスで実行する
+    script = f"import db\ndb.DB_FILE = {db_file!r}\n" + code
+    env = dict(os.environ, MASK_SHARDED='1')
+    out = subprocess.run([sys.executable, '-c', script], cwd=HERE, env=env, capture_output=True, text=True)
+    assert out.returncode == 0, out.stderr
+    return out.stdout.split()
+
+def test_delete_unknown_id_does_not_create_shard(tmp_path):
+    db_file = str(tmp_path / 'mask.db')
+    result = _run_sharded(db_file, """
+store_id = db.insert_store('店A', '地区A', '自店')
+db.insert_mask_status((store_id, '2024-04-05', 2024, 4, 1, 2, 10, 20))
+row_id = int(db.get_mask_status_page(limit=1)[0].iloc[0]['id'])
+print(db.delete_mask_status(5), db.delete_mask_status(7 * 10 ** 12), db.delete_mask_status(row_id))
+""")
+    assert result == ['0', '0', '1']
+    assert not os.path.exists(tmp_path / 'mask_shards' / 'area_000.db')
+    assert not os.path.exists(tmp_path / 'mask_shards' / 'area_007.db')
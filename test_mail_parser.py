@@ -0,0 +1,13 @@
+import mail_parser
+
+def test_unknown_store_does_not_inherit_previous_block():
+    text = "店A\nP  計  10\nS  計  20\n新しい店舗\nP  計  1\nS  計  2"
+    parsed = mail_parser.parse_report(text, {'店A': 1})
+    assert parsed['records'] == [(1, 10, 20)]
+    assert [line_no for line_no, _, _ in parsed['unparsable']] == [5, 6]
+
+def test_known_stores_in_sequence():
+    text = "店A\nP  計  10\nS  計  20\n店B\nP  計  3\nS  計  4"
+    parsed = mail_parser.parse_report(text, {'店A': 1, '店B': 2})
+    assert parsed['records'] == [(1, 10, 20), (2, 3, 4)]
+    assert parsed['unparsable'] == []